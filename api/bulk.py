@@ -0,0 +1,179 @@
+"""
+Bulk inserts of persons, shifts and overtimes.
+
+Items are validated in one pass and the rows that pass are inserted with
+executemany in batches of BATCH_SIZE, the invalid items are reported by their
+index in the request instead of failing the whole request. Nothing is
+committed here, the caller commits the transaction along with the changes to
+the daily hours summary.
+"""
+
+from typing import Any, Iterable
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from api import models
+from api.helpers import DISPLAY_TAG_ATTEMPTS, generate_display_tags
+from api.schemas import BulkError, Overtime, Person, Shift
+from api.search import person_trigram_rows
+from api.etags import OVERTIMES, PERSONS, SHIFTS, bump_versions
+from api.summary import SummaryDelta
+
+BATCH_SIZE = 1000
+
+
+def batches(items: list, size: int = BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def validate_items(
+    items: list[Any], schema: type[BaseModel]
+) -> tuple[list[tuple[int, BaseModel]], list[BulkError]]:
+    """Validates raw items against a schema, returning the valid items along with
+    their index and an error for every invalid item"""
+    return validate_indexed_items(enumerate(items), schema)
+
+
+def validate_indexed_items(
+    items: Iterable[tuple[int, Any]], schema: type[BaseModel]
+) -> tuple[list[tuple[int, BaseModel]], list[BulkError]]:
+    """Like validate_items for items that already carry their index"""
+    valid, errors = [], []
+    for index, item in items:
+        try:
+            valid.append((index, schema.model_validate(item)))
+        except ValidationError as e:
+            errors.append(
+                BulkError(
+                    index=index, detail=jsonable_encoder(e.errors(include_url=False))
+                )
+            )
+    return valid, errors
+
+
+async def existing_ids(db: AsyncSession, column, ids: set[int]) -> set[int]:
+    """Returns the ids that exist in the column, looked up in batches"""
+    found = set()
+    for batch in batches(list(ids)):
+        found.update(await db.scalars(select(column).filter(column.in_(batch))))
+    return found
+
+
+async def insert_persons(
+    db: AsyncSession, items: list[tuple[int, Person]]
+) -> tuple[int, list[BulkError]]:
+    """Inserts persons with batch allocated display tags and indexes their names"""
+    persons = [person for _, person in items]
+
+    for attempt in range(DISPLAY_TAG_ATTEMPTS):
+        tags = await generate_display_tags(persons, db)
+        rows = [
+            {
+                "first_name": person.first_name,
+                "last_name": person.last_name,
+                "job_role": person.job_role,
+                "birthday": person.birthday,
+                "display_tag": tag,
+            }
+            for person, tag in zip(persons, tags)
+        ]
+        try:
+            # A concurrent insert can take one of the tags, retry the batch
+            async with db.begin_nested():
+                for batch in batches(rows):
+                    ids = await db.scalars(
+                        insert(models.Person).returning(
+                            models.Person.id, sort_by_parameter_order=True
+                        ),
+                        batch,
+                    )
+                    trigram_rows = [
+                        trigram_row
+                        for person_id, row in zip(ids, batch)
+                        for trigram_row in person_trigram_rows(
+                            person_id, row["first_name"], row["last_name"]
+                        )
+                    ]
+                    if trigram_rows:
+                        await db.execute(insert(models.PersonTrigram), trigram_rows)
+        except IntegrityError:
+            if attempt == DISPLAY_TAG_ATTEMPTS - 1:
+                raise
+            continue
+        if rows:
+            await bump_versions(db, PERSONS)
+        return len(rows), []
+
+
+async def insert_shifts(
+    db: AsyncSession, items: list[tuple[int, Shift]]
+) -> tuple[int, list[BulkError]]:
+    """Inserts shifts of existing persons with a valid time range"""
+    persons = await existing_ids(
+        db, models.Person.id, {shift.person_id for _, shift in items}
+    )
+
+    rows, errors = [], []
+    for index, shift in items:
+        if shift.start_time > shift.end_time:
+            errors.append(
+                BulkError(index=index, detail="End time cannot be before start time")
+            )
+        elif shift.person_id not in persons:
+            errors.append(BulkError(index=index, detail="Person not found"))
+        else:
+            rows.append(shift.model_dump())
+
+    summary = SummaryDelta()
+    for row in rows:
+        summary.add_shift(row["person_id"], row["start_time"], row["end_time"])
+
+    for batch in batches(rows):
+        await db.execute(insert(models.Shift), batch)
+    await summary.apply(db)
+    if rows:
+        await bump_versions(db, SHIFTS)
+    return len(rows), errors
+
+
+async def insert_overtimes(
+    db: AsyncSession, items: list[tuple[int, Overtime]]
+) -> tuple[int, list[BulkError]]:
+    """Inserts overtimes for existing shifts that don't have an overtime yet"""
+    shift_ids = {overtime.shift_id for _, overtime in items}
+    shifts = {}
+    for batch in batches(list(shift_ids)):
+        result = await db.execute(
+            select(
+                models.Shift.id, models.Shift.person_id, models.Shift.start_time
+            ).filter(models.Shift.id.in_(batch))
+        )
+        shifts.update((shift.id, shift) for shift in result)
+    taken = await existing_ids(db, models.Overtime.shift_id, shift_ids)
+
+    rows, errors = [], []
+    for index, overtime in items:
+        if overtime.shift_id not in shifts:
+            errors.append(BulkError(index=index, detail="Shift not found"))
+        elif overtime.shift_id in taken:
+            errors.append(
+                BulkError(index=index, detail="Shift already has an overtime")
+            )
+        else:
+            taken.add(overtime.shift_id)
+            rows.append(overtime.model_dump())
+
+    summary = SummaryDelta()
+    for row in rows:
+        shift = shifts[row["shift_id"]]
+        summary.add_overtime(shift.person_id, shift.start_time, row["hours"])
+
+    for batch in batches(rows):
+        await db.execute(insert(models.Overtime), batch)
+    await summary.apply(db)
+    if rows:
+        await bump_versions(db, OVERTIMES)
+    return len(rows), errors
@@ -0,0 +1,148 @@
+"""
+Read-through cache for the lookups of single persons, shifts and overtimes.
+
+Values are the serialized responses of the lookup routes, keyed by entity and
+id. The in-process backend is a bounded LRU with a TTL per entry. With several
+workers each one has its own copy, so set CACHE_BACKEND=redis (and REDIS_URL) to
+share one cache between the workers, which requires the redis package.
+
+The write routes invalidate the keys they change after committing. A lookup
+that read the old row just before the commit can still store it, the TTL bounds
+how long such an entry is served.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+from api.exports import json_default
+
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 60))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 10000))
+
+
+def person_key(person_id: int) -> str:
+    return f"person:{person_id}"
+
+
+def shift_key(shift_id: int) -> str:
+    return f"shift:{shift_id}"
+
+
+def overtime_key(shift_id: int) -> str:
+    return f"overtime:{shift_id}"
+
+
+class MemoryBackend:
+    """LRU cache of at most max_entries values, each expiring ttl seconds after
+    it was stored"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.entries.pop(key, None)
+
+    async def clear(self):
+        self.entries.clear()
+
+
+class RedisBackend:
+    """Cache shared between processes through redis. Values are stored as JSON
+    with a TTL, the least recently used keys are evicted by redis according to
+    its maxmemory-policy (allkeys-lru)"""
+
+    def __init__(self, url: str, ttl: float = CACHE_TTL, prefix: str = "cache:"):
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError("The redis cache backend requires the redis package")
+
+        self.client = redis.asyncio.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value: Any):
+        await self.client.set(
+            self.prefix + key,
+            json.dumps(value, default=json_default),
+            px=int(self.ttl * 1000),
+        )
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def clear(self):
+        async for key in self.client.scan_iter(match=f"{self.prefix}*"):
+            await self.client.delete(key)
+
+
+class Cache:
+    """Read-through cache over a backend that counts hits and misses per entity"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+
+    async def get_or_load(
+        self, key: str, load: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        """Returns the cached value of the key, or loads and stores it. A value
+        of None (not found) is not cached"""
+        entity = key.split(":")[0]
+        value = await self.backend.get(key)
+        if value is not None:
+            self.hits[entity] = self.hits.get(entity, 0) + 1
+            return value
+
+        self.misses[entity] = self.misses.get(entity, 0) + 1
+        value = await load()
+        if value is not None:
+            await self.backend.set(key, value)
+        return value
+
+    async def invalidate(self, *keys: str):
+        await self.backend.delete(*keys)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """The hits and misses of this process per entity"""
+        return {
+            entity: {
+                "hits": self.hits.get(entity, 0),
+                "misses": self.misses.get(entity, 0),
+            }
+            for entity in sorted(self.hits.keys() | self.misses.keys())
+        }
+
+
+if os.environ.get("CACHE_BACKEND") == "redis":
+    cache = Cache(RedisBackend(os.environ.get("REDIS_URL", "redis://localhost:6379")))
+else:
+    cache = Cache(MemoryBackend())
@@ -1,20 +1,131 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from api.instrumentation import instrument_engine
 import os
+import time
 
+# The application uses the async engine, the sync engine is kept for
+# creating the schema and for the command line scripts
 engine = None
+async_engine = None
+
+
+def pool_options(environ=os.environ) -> dict:
+    """Pool settings of the async engine from the environment. Every gunicorn
+    worker has its own pool, so when DB_MAX_CONNECTIONS is set the connections
+    are divided between the WEB_CONCURRENCY workers, the pool takes what is
+    left after DB_MAX_OVERFLOW"""
+    workers = max(int(environ.get("WEB_CONCURRENCY", 1)), 1)
+    max_overflow = int(environ.get("DB_MAX_OVERFLOW", 5))
+    if "DB_POOL_SIZE" in environ:
+        pool_size = int(environ["DB_POOL_SIZE"])
+    elif "DB_MAX_CONNECTIONS" in environ:
+        per_worker = int(environ["DB_MAX_CONNECTIONS"]) // workers
+        if per_worker < 1:
+            raise ValueError("DB_MAX_CONNECTIONS is less than the number of workers")
+        max_overflow = min(max_overflow, per_worker - 1)
+        pool_size = per_worker - max_overflow
+    else:
+        pool_size = 5
+
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": float(environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": environ.get("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+
+def statement_timeout_args(environ=os.environ) -> dict:
+    """connect_args for asyncpg that cancel statements running longer than
+    DB_STATEMENT_TIMEOUT milliseconds"""
+    timeout = environ.get("DB_STATEMENT_TIMEOUT")
+    if not timeout:
+        return {}
+    return {"server_settings": {"statement_timeout": str(int(timeout))}}
+
+
+class PoolStats:
+    """Checkouts and the time spent waiting for a connection in this process"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited, including the time
+    to open a new connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.record(time.perf_counter() - start)
+
+
+def get_pool_stats() -> dict:
+    """Statistics of the async engine pool in this process"""
+    pool = async_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": pool_stats.checkouts,
+        "wait_seconds_total": round(pool_stats.wait_seconds, 6),
+        "wait_seconds_max": round(pool_stats.max_wait_seconds, 6),
+    }
+
 
 if "NAMESPACE" in os.environ and os.environ["NAMESPACE"] == "heroku":
     uri = os.environ["DATABASE_URL"]
     if uri and uri.startswith("postgres://"):
         SQLALCHEMY_DATABASE_URL = uri.replace("postgres://", "postgresql://", 1)
+        ASYNC_SQLALCHEMY_DATABASE_URL = uri.replace(
+            "postgres://", "postgresql+asyncpg://", 1
+        )
         engine = create_engine(SQLALCHEMY_DATABASE_URL)
+        async_engine = create_async_engine(
+            ASYNC_SQLALCHEMY_DATABASE_URL,
+            poolclass=TimedQueuePool,
+            connect_args=statement_timeout_args(),
+            **pool_options(),
+        )
 else:
     SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+    ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./sql_app.db"
     engine = create_engine(
         SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
     )
+    # SQLite has no statement timeout
+    async_engine = create_async_engine(
+        ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=TimedQueuePool, **pool_options()
+    )
+
+# Count the statements of the requests
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Objects are not expired on commit since attribute access cannot lazy load
+# from an AsyncSession
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
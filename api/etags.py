@@ -0,0 +1,101 @@
+"""
+Conditional GET with ETags built from per-table change versions.
+
+Every write bumps the version of the tables it changes in table_versions, in
+the same transaction. A read route declares the tables its response depends
+on, its ETag is a hash of the URL and their versions, so a request whose
+If-None-Match still matches is answered with 304 Not Modified before the
+route runs its query.
+
+The versions are read before the response is built. A write committed in
+between makes the body newer than the ETag, which only costs the client one
+more full response.
+"""
+
+import hashlib
+from fastapi import Depends, HTTPException, Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from api import models
+from dependencies import get_db
+
+PERSONS = models.Person.__tablename__
+SHIFTS = models.Shift.__tablename__
+OVERTIMES = models.Overtime.__tablename__
+
+
+def version_bumps(dialect_name: str, tables: tuple[str, ...]) -> list:
+    """Statements incrementing the versions of the tables, in name order so
+    concurrent writes lock the rows in the same order and cannot deadlock"""
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    table = models.TableVersion.__table__
+    upsert = dialect.insert(table).on_conflict_do_update(
+        index_elements=[table.c.name], set_={"version": table.c.version + 1}
+    )
+    return [upsert.values(name=name, version=1) for name in sorted(set(tables))]
+
+
+async def bump_versions(db: AsyncSession, *tables: str):
+    """Increments the versions of the tables, call before committing a write"""
+    for statement in version_bumps(db.bind.dialect.name, tables):
+        await db.execute(statement)
+
+
+async def table_versions(db: AsyncSession, tables: tuple[str, ...]) -> dict[str, int]:
+    result = await db.execute(
+        select(models.TableVersion.name, models.TableVersion.version).filter(
+            models.TableVersion.name.in_(tables)
+        )
+    )
+    versions = dict(result.all())
+    return {name: versions.get(name, 0) for name in tables}
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def conditional_get(*tables: str):
+    """Dependency that sets the ETag of the response and answers 304 when the
+    If-None-Match header of the request still matches it"""
+
+    async def check_etag(request: Request, db: AsyncSession = Depends(get_db)):
+        versions = await table_versions(db, tables)
+        # Queries such as ?fields= or ?cursor= change the body, the URL is hashed too
+        digest = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode())
+        digest.update(repr(sorted(versions.items())).encode())
+        etag = f'W/"{digest.hexdigest()}"'
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(etag, if_none_match):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        # Added to the response by ETagMiddleware, which also covers the routes
+        # that return a Response themselves
+        request.state.etag = etag
+
+    return check_etag
+
+
+class ETagMiddleware:
+    """Adds the ETag set by conditional_get to the response headers"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_etag(message: Message):
+            etag = scope.get("state", {}).get("etag")
+            if message["type"] == "http.response.start" and etag:
+                headers = MutableHeaders(scope=message)
+                headers.setdefault("ETag", etag)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
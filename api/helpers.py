@@ -1,155 +1,235 @@
 from datetime import datetime, time
-from typing import List, Optional
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
 from api import models
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, select, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import Select
+import base64
+from collections import defaultdict
+import json
 import random
 from api.models import Person
-from dependencies import get_db
-from sqlalchemy.orm import Session, Query
-from fastapi import Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from api.schemas import OvertimeOut
+from api.serialization import row_items
+from api.search import NAME_FIELDS, name_match_filter, name_match_rank
+from fastapi_pagination import create_page, resolve_params
 
 
-def generate_display_tag(person: Person, db: Session = Depends(get_db)) -> str:
-    """Generate a unique display_tag"""
-    prefix = person.first_name[0:3] + person.last_name[0:2]
-    suffix = random.randint(100, 999)
-    tag = prefix.lower() + str(suffix)
+DISPLAY_TAG_SAMPLE = 16
+DISPLAY_TAG_ATTEMPTS = 5
 
-    while tag in db.query(models.Person.display_tag).all():
-        prefix = person.first_name[0:3] + person.last_name[0:2]
-        suffix = random.randint(100, 999)
-        tag = prefix + str(suffix)
 
-    return tag
+def display_tag_prefix(first_name: str, last_name: str) -> str:
+    """The display_tag prefix shared by all persons with similar names"""
+    return (first_name[0:3] + last_name[0:2]).lower()
 
 
-def person_search(search_string: str, db: Session = Depends(get_db)) -> Query:
-    """Returns a search query for a provided search string"""
-    pattern = f"%{search_string}%"
-    if " " in search_string:
-        # If the search_string contains a space, assume it's 'first_name last_name'
-        # Ignore the rest of the names in search.
-        first_name, last_name = search_string.split(" ")[:2]
-        query = db.query(models.Person).filter(
-            and_(
-                func.lower(models.Person.first_name).like(
-                    func.lower(f"%{first_name}%")
-                ),
-                func.lower(models.Person.last_name).like(func.lower(f"%{last_name}%")),
+def display_tag_bucket(prefix: str, digits: int):
+    """Filter clause selecting the tags of a prefix with a suffix of the given
+    number of digits, as a range over the unique display_tag index"""
+    return and_(
+        models.Person.display_tag >= prefix + str(10 ** (digits - 1)),
+        models.Person.display_tag <= prefix + str(10**digits - 1),
+        func.length(models.Person.display_tag) == len(prefix) + digits,
+    )
+
+
+async def generate_display_tag(person: Person, db: AsyncSession) -> str:
+    """Generate a unique display_tag. A few random suffixes of the prefix are checked
+    with one indexed lookup, only when all of them are taken the bucket is read to
+    find a free suffix, and a full bucket is widened with one more suffix digit"""
+    prefix = display_tag_prefix(person.first_name, person.last_name)
+    digits = 3
+
+    while True:
+        suffixes = range(10 ** (digits - 1), 10**digits)
+        candidates = [
+            prefix + str(suffix)
+            for suffix in random.sample(
+                suffixes, min(DISPLAY_TAG_SAMPLE, len(suffixes))
+            )
+        ]
+        taken = set(
+            await db.scalars(
+                select(models.Person.display_tag).filter(
+                    models.Person.display_tag.in_(candidates)
+                )
             )
         )
-    else:
-        query = db.query(models.Person).filter(
-            or_(
-                func.lower(models.Person.first_name).like(func.lower(pattern)),
-                func.lower(models.Person.last_name).like(func.lower(pattern)),
+        free = [tag for tag in candidates if tag not in taken]
+        if free:
+            return free[0]
+
+        taken = set(
+            await db.scalars(
+                select(models.Person.display_tag).filter(
+                    display_tag_bucket(prefix, digits)
+                )
             )
         )
+        free = [prefix + str(s) for s in suffixes if prefix + str(s) not in taken]
+        if free:
+            return random.choice(free)
+        digits += 1
 
-    return query
+
+async def generate_display_tags(persons: list[Person], db: AsyncSession) -> list[str]:
+    """Generate unique display_tags for a batch of persons, reading the bucket of
+    each prefix once instead of looking up every person separately"""
+    by_prefix = defaultdict(list)
+    for i, person in enumerate(persons):
+        by_prefix[display_tag_prefix(person.first_name, person.last_name)].append(i)
+
+    tags = [None] * len(persons)
+    for prefix, remaining in by_prefix.items():
+        digits = 3
+        while remaining:
+            taken = set(
+                await db.scalars(
+                    select(models.Person.display_tag).filter(
+                        display_tag_bucket(prefix, digits)
+                    )
+                )
+            )
+            free = [
+                prefix + str(suffix)
+                for suffix in range(10 ** (digits - 1), 10**digits)
+                if prefix + str(suffix) not in taken
+            ]
+            chosen = random.sample(free, min(len(free), len(remaining)))
+            for i, tag in zip(remaining, chosen):
+                tags[i] = tag
+            remaining = remaining[len(chosen) :]
+            digits += 1
+
+    return tags
+
+
+async def add_person(person: Person, db: AsyncSession) -> models.Person:
+    """Adds a person with a new display_tag to the session. A concurrent request
+    can take the same tag before this one commits, in that case the insert is
+    rolled back to a savepoint and retried with a new tag"""
+    for _ in range(DISPLAY_TAG_ATTEMPTS):
+        db_person = models.Person(
+            first_name=person.first_name,
+            last_name=person.last_name,
+            display_tag=await generate_display_tag(person, db),
+            job_role=person.job_role,
+            birthday=person.birthday,
+        )
+        try:
+            async with db.begin_nested():
+                db.add(db_person)
+        except IntegrityError:
+            continue
+        return db_person
+
+    raise HTTPException(status_code=409, detail="Could not allocate a display tag")
+
+
+def split_search_string(search_string: str) -> list[tuple[str, tuple[str, ...]]]:
+    """Splits a search string into terms and the name fields each term is matched on"""
+    if " " in search_string:
+        # If the search_string contains a space, assume it's 'first_name last_name'
+        # Ignore the rest of the names in search.
+        first_name, last_name = search_string.split(" ")[:2]
+        return [(first_name, ("first_name",)), (last_name, ("last_name",))]
+    return [(search_string, NAME_FIELDS)]
 
 
-def shift_join_with_shift_id(shift_id: int, db) -> dict[str:str]:
+def person_search_filter(search_string: str):
+    """Returns the filter clause matching persons against a provided search string,
+    using the trigram index to avoid scanning the persons table"""
+    return and_(
+        *[
+            name_match_filter(term, fields)
+            for term, fields in split_search_string(search_string)
+        ]
+    )
+
+
+def person_search_rank(search_string: str):
+    """Returns an order by expression ranking exact and prefix matches first"""
+    return sum(
+        name_match_rank(term, fields)
+        for term, fields in split_search_string(search_string)
+    )
+
+
+def shift_with_person_select() -> Select:
+    """Select statement joining the columns of Shifts with the name of the
+    associated Person. Each resulting row maps directly onto ShiftOut"""
+    return select(
+        *models.Shift.__table__.columns,
+        models.Person.first_name,
+        models.Person.last_name,
+    ).join(models.Person, models.Shift.person_id == models.Person.id)
+
+
+async def shift_join_with_shift_id(shift_id: int, db: AsyncSession) -> dict[str:str]:
     """Joins tables of Shifts and Persons to be able to get the person name
     for the person associated with the Shift"""
-    shift_query = (
-        db.query(models.Shift, models.Person)
-        .join(models.Person, models.Shift.person_id == models.Person.id)
-        .filter(models.Shift.id == shift_id)
-    )
+    shift_query = shift_with_person_select().filter(models.Shift.id == shift_id)
 
-    shift_with_person = shift_query.first()
+    shift_with_person = (await db.execute(shift_query)).first()
 
     if shift_with_person:
-        shift, person = shift_with_person
-        joined_shift_dict = {
-            "id": shift.id,
-            "start_time": shift.start_time,
-            "end_time": shift.end_time,
-            "comment": shift.comment,
-            "person_id": shift.person_id,
-            "created_at": shift.created_at,
-            "updated_at": shift.updated_at,
-            "field_A": shift.field_A,
-            "field_B": shift.field_B,
-            "field_C": shift.field_C,
-            "field_D": shift.field_D,
-            "field_E": shift.field_E,
-            "first_name": person.first_name,
-            "last_name": person.last_name,
-        }
-
-        return joined_shift_dict
+        return shift_with_person._asdict()
 
 
 def shift_join_with_person_id(
     person_id: int,
-    db,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     sort_by: Optional[str] = None,  # new parameter to specify sorting attribute
     order_type: Optional[str] = "asc",
-) -> List[dict]:
+) -> Select:
     """Joins tables of Shifts and Persons to be able to get the person name for
-    the person associated with the Shift. Returns a list of all shifts associated with the person
+    the person associated with the Shift. Returns a select statement for all shifts
+    associated with the person, to be paginated in the database
     """
-    shift_query = (
-        db.query(models.Shift, models.Person)
-        .join(models.Person, models.Shift.person_id == models.Person.id)
-        .filter(models.Shift.person_id == person_id)
-    )
+    shift_query = shift_with_person_select().filter(models.Shift.person_id == person_id)
 
     shift_query = apply_date_filters(
         shift_query, start_date=start_date, end_date=end_date
     )
 
-    if sort_by == "start_time":
-        shift_query = sort_query_by(shift_query, models.Shift.start_time, order_type)
+    attribute = models.Shift.start_time if sort_by == "start_time" else None
 
-    shift_with_person = shift_query.all()
+    return sort_query_by(shift_query, attribute, order_type, models.Shift.id)
 
-    shifts = []
-    if shift_with_person:
-        for shift, person in shift_with_person:
-            joined_shift_dict = {
-                "id": shift.id,
-                "start_time": shift.start_time,
-                "end_time": shift.end_time,
-                "comment": shift.comment,
-                "person_id": shift.person_id,
-                "created_at": shift.created_at,
-                "updated_at": shift.updated_at,
-                "field_A": shift.field_A,
-                "field_B": shift.field_B,
-                "field_C": shift.field_C,
-                "field_D": shift.field_D,
-                "field_E": shift.field_E,
-                "first_name": person.first_name,
-                "last_name": person.last_name,
-            }
-            shifts.append(joined_shift_dict)
-
-    return shifts
-
-
-def sort_query_by(query: Query, attribute, order_type):
-    """Sorts the shift query by the given attribute and order_type"""
+
+def sort_query_by(query: Select, attribute, order_type, tiebreaker=None):
+    """Sorts the shift query by the given attribute and order_type. A unique
+    tiebreaker column keeps the page window stable between requests and is
+    sorted in the same direction, matching the order of paginate_by_cursor"""
     if attribute:
+        # NULLs are sorted last in both directions so that SQLite and Postgres
+        # return the same order
         if order_type == "asc":
-            query = query.order_by(attribute.asc())
+            query = query.order_by(attribute.asc().nulls_last())
         elif order_type == "desc":
-            query = query.order_by(attribute.desc())
+            query = query.order_by(attribute.desc().nulls_last())
         else:
             raise HTTPException(
                 status_code=400,
                 detail=f"Order type is either asc or desc, you entered {order_type}",
             )
+    if tiebreaker is not None:
+        if attribute is not None and order_type == "desc":
+            query = query.order_by(tiebreaker.desc())
+        else:
+            query = query.order_by(tiebreaker.asc())
     return query
 
 
 def apply_date_filters(
-    query: Query, start_date: Optional[datetime], end_date: Optional[datetime]
-) -> Query:
+    query: Select, start_date: Optional[datetime], end_date: Optional[datetime]
+) -> Select:
     """Applies date filters to the shift query"""
     if start_date:
         start_of_day = datetime.combine(start_date, time.min)
@@ -158,3 +238,256 @@ def apply_date_filters(
         end_of_day = datetime.combine(end_date, time.max)
         query = query.filter(models.Shift.start_time <= end_of_day)
     return query
+
+
+def select_fields(query: Select, fields: list[str], keep: tuple = ()) -> Select:
+    """Narrows the columns of a select statement to the named fields and the
+    columns in keep, the joins and filters are left as they are"""
+    names = set(fields) | set(keep)
+    return query.with_only_columns(
+        *[column for column in query.selected_columns if column.key in names],
+        maintain_column_froms=True,
+    )
+
+
+OVERTIME_FIELDS = list(OvertimeOut.model_fields)
+
+
+async def overtimes_by_shift_ids(
+    db: AsyncSession, shift_ids: list[int]
+) -> dict[int, list[dict]]:
+    """The overtimes of many shifts in one IN query, like a selectin load of the
+    Shift.overtimes backref"""
+    overtimes = defaultdict(list)
+    result = await db.execute(
+        select(*models.Overtime.__table__.columns).filter(
+            models.Overtime.shift_id.in_(shift_ids)
+        )
+    )
+    for overtime in row_items(result, OVERTIME_FIELDS):
+        overtimes[overtime["shift_id"]].append(overtime)
+    return overtimes
+
+
+async def overtimes_of_shift(db: AsyncSession, shift_id: int) -> Optional[list[dict]]:
+    """The overtimes of a shift, or None when the shift does not exist. The shift
+    is outer joined so both are answered by one query"""
+    result = await db.execute(
+        select(models.Shift.id, *models.Overtime.__table__.columns)
+        .outerjoin(models.Overtime, models.Overtime.shift_id == models.Shift.id)
+        .filter(models.Shift.id == shift_id)
+    )
+    rows = result.all()
+    if rows:
+        return row_items(
+            [row for row in rows if row.shift_id is not None], OVERTIME_FIELDS
+        )
+
+
+class Include(NamedTuple):
+    """Related rows embedded in every item of a page under name. The load
+    function gets the key values of all rows on the page at once"""
+
+    name: str
+    key: str
+    load: Callable[[AsyncSession, list], Awaitable[dict[Any, list]]]
+
+
+SHIFT_INCLUDES = {"overtime": Include("overtimes", "id", overtimes_by_shift_ids)}
+
+
+def parse_include(
+    include: Optional[str], allowed: dict[str, Include]
+) -> tuple[Include, ...]:
+    """Splits a comma separated include parameter into the allowed includes"""
+    if include is None:
+        return ()
+    names = [name.strip() for name in include.split(",")]
+    if any(name not in allowed for name in names):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Include must be some of {', '.join(allowed)}",
+        )
+    return tuple(allowed[name] for name in dict.fromkeys(names))
+
+
+async def include_related(
+    db: AsyncSession, rows: list, items: list[dict], includes: tuple[Include, ...]
+):
+    """Adds the related rows of each include to the items of the page"""
+    for include in includes:
+        related = await include.load(db, [row._mapping[include.key] for row in rows])
+        for row, item in zip(rows, items):
+            item[include.name] = related.get(row._mapping[include.key], [])
+
+
+async def paginate_with_total(
+    db: AsyncSession,
+    query: Select,
+    item_schema: type[BaseModel],
+    fields: Optional[list[str]] = None,
+    includes: tuple[Include, ...] = (),
+) -> ORJSONResponse:
+    """Paginates a select statement in the database, the rows on the page are
+    serialized with the given fields of the item schema, only those columns are
+    selected. The total is counted over the unordered statement, so the database
+    only sorts up to the page window instead of sorting the whole filtered result
+    as COUNT(*) OVER () would. The includes are loaded with one query each"""
+    fields = fields or list(item_schema.model_fields)
+    query = select_fields(query, fields, tuple(include.key for include in includes))
+    params = resolve_params()
+    raw_params = params.to_raw_params().as_limit_offset()
+
+    page_query = query.limit(raw_params.limit).offset(raw_params.offset)
+    rows = (await db.execute(page_query)).all()
+
+    count_query = select(func.count()).select_from(query.order_by(None).subquery())
+    total = await db.scalar(count_query)
+
+    # The page and links only depend on the params and the total
+    page = create_page([], total=total, params=params).model_dump(mode="json")
+    page["items"] = row_items(rows, fields)
+    await include_related(db, rows, page["items"], includes)
+    return ORJSONResponse(page)
+
+
+MAX_LOOKUP_IDS = 1000
+
+
+def parse_ids(ids: str) -> list[int]:
+    """Splits a comma separated list of ids, keeping the first of duplicates"""
+    try:
+        return list(dict.fromkeys(int(id) for id in ids.split(",")))
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="Ids must be comma separated integers"
+        )
+
+
+async def lookup_by_ids(
+    db: AsyncSession,
+    query: Select,
+    id_column,
+    ids: list[int],
+    item_schema: type[BaseModel],
+    fields: Optional[list[str]] = None,
+    includes: tuple[Include, ...] = (),
+) -> ORJSONResponse:
+    """Looks up many rows of a select statement with one IN query. The response
+    has the shape of a LookupResult, the items are in the order of the ids and
+    the ids that were not found are listed in missing"""
+    if len(ids) > MAX_LOOKUP_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_LOOKUP_IDS} ids can be looked up"
+        )
+    fields = fields or list(item_schema.model_fields)
+    keep = [id_column.key] + [include.key for include in includes]
+    query = select_fields(query, fields, tuple(keep)).filter(id_column.in_(ids))
+
+    found = {row._mapping[id_column.key]: row for row in await db.execute(query)}
+    rows = [found[id] for id in ids if id in found]
+    items = row_items(rows, fields)
+    await include_related(db, rows, items, includes)
+    return ORJSONResponse(
+        {"items": items, "missing": [id for id in ids if id not in found]}
+    )
+
+
+def encode_cursor(values: list) -> str:
+    """Encodes the key values of the last row on a page into an opaque cursor"""
+    payload = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str, key_columns: list) -> list:
+    """Decodes a cursor created by encode_cursor back into typed key values.
+    Only the sort attribute may be NULL, the last key column is the tiebreaker"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(key_columns):
+            raise ValueError("Cursor does not match the sort keys")
+
+        decoded = []
+        for i, (value, column) in enumerate(zip(values, key_columns)):
+            python_type = column.type.python_type
+            if value is None and i < len(key_columns) - 1:
+                decoded.append(value)
+                continue
+            if python_type is datetime and isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            if not isinstance(value, python_type) or isinstance(value, bool):
+                raise ValueError("Cursor value does not match the sort key type")
+            decoded.append(value)
+        return decoded
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(key_columns: list, values: list, order_type: str):
+    """Filter clause selecting the rows after the given key values in the order
+    of sort_query_by, where NULL sort keys come last in both directions"""
+    column, value = key_columns[0], values[0]
+    if value is None:
+        return and_(
+            column.is_(None), keyset_filter(key_columns[1:], values[1:], order_type)
+        )
+
+    value = literal(value, column.type)
+    after = column < value if order_type == "desc" else column > value
+    if len(key_columns) == 1:
+        return after
+    return or_(
+        after,
+        and_(column == value, keyset_filter(key_columns[1:], values[1:], order_type)),
+        column.is_(None),
+    )
+
+
+async def paginate_by_cursor(
+    db: AsyncSession,
+    query: Select,
+    key_columns: list,
+    order_type: Optional[str],
+    cursor: str,
+    item_schema: type[BaseModel],
+    fields: Optional[list[str]] = None,
+    includes: tuple[Include, ...] = (),
+) -> ORJSONResponse:
+    """Keyset pagination of a select statement. Rows are ordered by the key columns
+    (the sort attribute followed by a unique tiebreaker) and the page starts right
+    after the row encoded in the cursor, so no rows are scanned and discarded.
+    An empty cursor returns the first page. The response has the shape of a
+    CursorPage of the item schema, limited to the given fields"""
+    fields = fields or list(item_schema.model_fields)
+    # The key columns are selected too, the next cursor is built from them
+    keep = [column.key for column in key_columns] + [i.key for i in includes]
+    query = select_fields(query, fields, tuple(keep))
+    size = resolve_params().size
+    *attributes, tiebreaker = key_columns
+    query = sort_query_by(
+        query, attributes[0] if attributes else None, order_type, tiebreaker
+    )
+
+    if cursor:
+        values = decode_cursor(cursor, key_columns)
+        query = query.filter(keyset_filter(key_columns, values, order_type))
+
+    # Fetch one extra row to know if there is a next page
+    rows = (await db.execute(query.limit(size + 1))).all()
+
+    next_cursor = None
+    if len(rows) > size:
+        last_row = rows[size - 1]._mapping
+        next_cursor = encode_cursor([last_row[column.key] for column in key_columns])
+
+    items = row_items(rows[:size], fields)
+    await include_related(db, rows[:size], items, includes)
+    return ORJSONResponse(
+        {
+            "items": items,
+            "size": size,
+            "next_cursor": next_cursor,
+        }
+    )
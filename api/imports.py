@@ -0,0 +1,121 @@
+"""
+Streaming imports of NDJSON and CSV request bodies.
+
+The body is read chunk by chunk and split into records as it arrives, every
+BATCH_SIZE records are validated, inserted through api/bulk.py and committed,
+so memory use does not depend on the size of the upload.
+"""
+
+import csv
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.bulk import BATCH_SIZE, validate_indexed_items
+from api.schemas import BulkError, ImportResult
+
+# Only the first errors are returned, the rest are counted in rejected
+MAX_REPORTED_ERRORS = 100
+
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+
+
+async def read_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Splits a byte stream into decoded lines without reading it all"""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8").rstrip("\r")
+
+
+async def read_ndjson(
+    lines: AsyncIterator[str],
+) -> AsyncIterator[tuple[int, Any | BulkError]]:
+    """Yields one record per non-empty line"""
+    index = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError:
+            yield index, BulkError(index=index, detail="Invalid JSON")
+        index += 1
+
+
+async def read_csv(
+    lines: AsyncIterator[str],
+) -> AsyncIterator[tuple[int, Any | BulkError]]:
+    """Yields one record per CSV row keyed by the header row. A quoted value
+    can span lines, empty values are read as missing"""
+    header = None
+    index = 0
+    pending = ""
+    async for line in lines:
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            # Inside a quoted value that continues on the next line
+            continue
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+
+        [values] = csv.reader([record])
+        if header is None:
+            header = values
+            continue
+        if len(values) != len(header):
+            yield index, BulkError(index=index, detail=f"Expected {len(header)} values")
+        else:
+            yield index, {
+                key: value for key, value in zip(header, values) if value != ""
+            }
+        index += 1
+
+
+async def import_stream(
+    db: AsyncSession,
+    stream: AsyncIterator[bytes],
+    content_type: str,
+    schema: type[BaseModel],
+    insert: Callable[[AsyncSession, list], Awaitable[tuple[int, list[BulkError]]]],
+) -> ImportResult:
+    """Validates and inserts the records of an NDJSON or CSV stream in committed
+    batches of BATCH_SIZE"""
+    lines = read_lines(stream)
+    if content_type.split(";")[0].strip() in CSV_CONTENT_TYPES:
+        records = read_csv(lines)
+    else:
+        records = read_ndjson(lines)
+
+    result = ImportResult(inserted=0, rejected=0, errors=[])
+
+    def reject(errors: list[BulkError]):
+        result.rejected += len(errors)
+        space = MAX_REPORTED_ERRORS - len(result.errors)
+        result.errors.extend(errors[: max(space, 0)])
+
+    async def flush(batch: list):
+        valid, errors = validate_indexed_items(batch, schema)
+        inserted, insert_errors = await insert(db, valid)
+        await db.commit()
+        result.inserted += inserted
+        reject(sorted(errors + insert_errors, key=lambda error: error.index))
+
+    batch = []
+    async for index, record in records:
+        if isinstance(record, BulkError):
+            reject([record])
+            continue
+        batch.append((index, record))
+        if len(batch) >= BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    return result
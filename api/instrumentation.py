@@ -0,0 +1,153 @@
+"""
+Counting of the SQL statements executed while handling a request.
+
+The middleware sets a QueryStats for the request in a context variable, the
+engine event hooks add every statement executed in that context to it. The
+count and time are returned in the X-DB-Queries and X-DB-Time headers, and
+requests over the thresholds are logged. A statement executed many times in
+one request is logged as a likely N+1 query, usually a query per row that
+should have been one query for all rows.
+"""
+
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Statements and time spent in the database for one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """Statements executed at least threshold times"""
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "current_query_stats", default=None
+)
+# Stats of capture_queries, which see the statements of every context
+captures: list[QueryStats] = []
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    for captured in captures:
+        captured.record(statement, seconds)
+
+
+def instrument_engine(engine: Engine):
+    """Adds the statements of the engine to the stats of the current request,
+    pass the sync_engine of an async engine"""
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+@contextmanager
+def capture_queries() -> Iterator[QueryStats]:
+    """Records the statements executed by any request while in the block, also
+    those of a TestClient running the app in another thread"""
+    stats = QueryStats()
+    captures.append(stats)
+    try:
+        yield stats
+    finally:
+        captures.remove(stats)
+
+
+class QueryStatsMiddleware:
+    """Collects the statements of every request, returns their count and time
+    in headers and logs slow requests and repeated statements"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        headers: bool = True,
+        max_queries: int = 20,
+        max_seconds: float = 0.5,
+        repeated_threshold: int = 5,
+    ):
+        self.app = app
+        self.headers = headers
+        self.max_queries = max_queries
+        self.max_seconds = max_seconds
+        self.repeated_threshold = repeated_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_with_headers(message: Message):
+            if self.headers and message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Queries"] = str(stats.count)
+                headers["X-DB-Time"] = f"{stats.seconds * 1000:.3f}"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_query_stats.reset(token)
+            self.log(scope, stats)
+
+    def log(self, scope: Scope, stats: QueryStats):
+        request = f"{scope['method']} {scope['path']}"
+        if stats.count > self.max_queries or stats.seconds > self.max_seconds:
+            logger.warning(
+                "%s executed %d statements in %.1f ms",
+                request,
+                stats.count,
+                stats.seconds * 1000,
+            )
+        for statement, count in stats.repeated(self.repeated_threshold):
+            logger.warning(
+                "%s executed the same statement %d times, possible N+1 query: %s",
+                request,
+                count,
+                " ".join(statement.split())[:200],
+            )
+
+
+def query_stats_options(environ=os.environ) -> dict:
+    """Options of QueryStatsMiddleware from the environment"""
+    return {
+        "headers": environ.get("DB_QUERY_HEADERS", "true").lower() == "true",
+        "max_queries": int(environ.get("DB_LOG_QUERIES", 20)),
+        "max_seconds": float(environ.get("DB_LOG_SECONDS", 0.5)),
+        "repeated_threshold": int(environ.get("DB_REPEATED_STATEMENTS", 5)),
+    }
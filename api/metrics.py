@@ -0,0 +1,100 @@
+"""
+Prometheus metrics of the requests per route.
+
+Every gunicorn worker is a separate process. When PROMETHEUS_MULTIPROC_DIR is
+set the workers write their metrics to files in that directory and /metrics
+adds up the files of all workers, so a scrape sees the totals of the server
+whichever worker answers it. gunicorn.conf.py clears the directory on start
+and removes the files of exited workers.
+"""
+
+import os
+import time
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from api.instrumentation import QueryStats, current_query_stats
+
+REQUESTS = Counter(
+    "http_requests_total",
+    "Requests by route and status code",
+    ["method", "route", "status"],
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request by route",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL statements executed per request by route",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent executing SQL statements per request by route",
+    ["method", "route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+METRICS_PATH = "/metrics"
+
+
+def route_label(scope: Scope) -> str:
+    """The path template of the matched route, so /person/1 and /person/2 are
+    counted together. Unmatched paths share one label to bound the series"""
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """Records the count, status, latency and SQL statements of every request"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] == METRICS_PATH:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Set by QueryStatsMiddleware around this one
+            stats = current_query_stats.get() or QueryStats()
+            method, route = scope["method"], route_label(scope)
+            REQUESTS.labels(method, route, str(status)).inc()
+            LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            DB_QUERIES.labels(method, route).observe(stats.count)
+            DB_TIME.labels(method, route).observe(stats.seconds)
+
+
+def metrics_response() -> Response:
+    """The metrics in the Prometheus text format, of all workers when running
+    in multiprocess mode"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
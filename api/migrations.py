@@ -0,0 +1,139 @@
+"""
+Versioned schema migrations.
+
+Base.metadata.create_all only creates missing tables, it never alters an
+existing database. Changes to existing tables are added here as numbered
+migrations, the applied versions are recorded in the schema_migrations table so
+every migration runs exactly once per database.
+"""
+
+from datetime import datetime
+from typing import Callable, NamedTuple
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+from sqlalchemy import delete, inspect, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+from api.database import Base
+from api.search import person_trigram_rows
+from api.summary import rebuild_summary
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100)),
+    Column("applied_at", DateTime, default=datetime.now),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    # Migrations that build indexes run outside of a transaction so that
+    # Postgres can build them concurrently without locking the table for writes
+    transactional: bool = True
+
+
+def create_indexes(conn: Connection, table_name: str, index_names: list[str]):
+    """Creates the named indexes declared in api/models.py if they don't exist"""
+    table = Base.metadata.tables[table_name]
+    existing = {index["name"] for index in inspect(conn).get_indexes(table_name)}
+
+    for index in table.indexes:
+        if index.name in index_names and index.name not in existing:
+            concurrently = conn.dialect.name == "postgresql"
+            index.dialect_options["postgresql"]["concurrently"] = concurrently
+            try:
+                index.create(conn)
+            finally:
+                # create_all runs in a transaction, keep the model index plain
+                index.dialect_options["postgresql"]["concurrently"] = False
+
+
+def add_shift_and_person_indexes(conn: Connection):
+    create_indexes(
+        conn, "shifts", ["ix_shifts_person_id_start_time", "ix_shifts_start_time"]
+    )
+    create_indexes(conn, "persons", ["ix_persons_last_name", "ix_persons_first_name"])
+
+
+def add_person_trigrams(conn: Connection):
+    """Creates the trigram search index and fills it from the existing persons"""
+    trigram_table = Base.metadata.tables["person_trigrams"]
+    persons = Base.metadata.tables["persons"]
+    trigram_table.create(conn, checkfirst=True)
+    conn.execute(delete(trigram_table))
+
+    result = conn.execute(
+        select(persons.c.id, persons.c.first_name, persons.c.last_name)
+    )
+    for batch in result.partitions(1000):
+        rows = [
+            row
+            for person in batch
+            for row in person_trigram_rows(
+                person.id, person.first_name, person.last_name
+            )
+        ]
+        if rows:
+            conn.execute(insert(trigram_table), rows)
+
+
+def widen_display_tag(conn: Connection):
+    """Widens display_tag so a full prefix bucket can grow an extra suffix digit.
+    SQLite does not enforce the length of VARCHAR columns"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text("ALTER TABLE persons ALTER COLUMN display_tag TYPE VARCHAR(16)")
+        )
+
+
+def add_person_daily_hours(conn: Connection):
+    """Creates the daily hours summary and fills it from the existing shifts"""
+    Base.metadata.tables["person_daily_hours"].create(conn, checkfirst=True)
+    rebuild_summary(conn)
+
+
+MIGRATIONS = [
+    Migration(1, "add_shift_and_person_indexes", add_shift_and_person_indexes, False),
+    Migration(2, "add_person_trigrams", add_person_trigrams),
+    Migration(3, "widen_display_tag", widen_display_tag),
+    Migration(4, "add_person_daily_hours", add_person_daily_hours),
+]
+
+
+def applied_versions(engine: Engine) -> set[int]:
+    """Returns the versions already applied to the database"""
+    migration_metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        return set(conn.scalars(select(schema_migrations.c.version)))
+
+
+def run_migrations(engine: Engine) -> list[int]:
+    """Applies all pending migrations in order and returns their versions"""
+    done = applied_versions(engine)
+    applied = []
+
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in done:
+            continue
+
+        if migration.transactional:
+            with engine.begin() as conn:
+                migration.upgrade(conn)
+        else:
+            with engine.connect() as conn:
+                autocommit = conn.execution_options(isolation_level="AUTOCOMMIT")
+                migration.upgrade(autocommit)
+
+        with engine.begin() as conn:
+            conn.execute(
+                insert(schema_migrations).values(
+                    version=migration.version, name=migration.name
+                )
+            )
+        applied.append(migration.version)
+
+    return applied
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, String, Date, DateTime, Index
 from sqlalchemy.orm import relationship, column_property
 from .database import Base
 from datetime import datetime
@@ -6,6 +6,10 @@ from datetime import datetime
 
 class Person(Base):
     __tablename__ = "persons"
+    __table_args__ = (
+        Index("ix_persons_last_name", "last_name"),
+        Index("ix_persons_first_name", "first_name"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     first_name = Column(String(35))
     last_name = Column(String(35))
@@ -13,7 +17,7 @@ class Person(Base):
     birthday = Column(DateTime)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
-    display_tag = Column(String(8), unique=True)
+    display_tag = Column(String(16), unique=True)
 
     # Dummy data fields
     field_A = Column(String(35))
@@ -25,6 +29,10 @@ class Person(Base):
 
 class Shift(Base):
     __tablename__ = "shifts"
+    __table_args__ = (
+        Index("ix_shifts_person_id_start_time", "person_id", "start_time"),
+        Index("ix_shifts_start_time", "start_time"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     start_time = Column(DateTime)
     end_time = Column(DateTime)
@@ -62,3 +70,34 @@ class Overtime(Base):
     field_E = Column(String(35))
 
     shift = relationship("Shift", backref="overtimes")
+
+
+class PersonTrigram(Base):
+    """Trigram index over the lowercased first and last names of persons, used
+    to find substring matches without scanning the persons table"""
+
+    __tablename__ = "person_trigrams"
+    trigram = Column(String(3), primary_key=True)
+    field = Column(String(10), primary_key=True)
+    person_id = Column(Integer, ForeignKey("persons.id"), primary_key=True, index=True)
+
+
+class PersonDailyHours(Base):
+    """Shifts and hours per person and day, maintained by the write routes
+    through api/summary.py so reports don't scan the shifts table"""
+
+    __tablename__ = "person_daily_hours"
+    person_id = Column(Integer, ForeignKey("persons.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    shift_count = Column(Integer, nullable=False, default=0)
+    seconds_worked = Column(Integer, nullable=False, default=0)
+    overtime_hours = Column(Integer, nullable=False, default=0)
+
+
+class TableVersion(Base):
+    """Change counter per table, bumped in the transaction of every write to
+    the table and used to build the ETags of the read routes"""
+
+    __tablename__ = "table_versions"
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
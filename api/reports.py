@@ -0,0 +1,30 @@
+"""
+Aggregations for the reports, computed with GROUP BY in the database.
+
+SQLite and Postgres have no common functions for date arithmetic, the
+expressions below are picked by the name of the dialect, e.g. db.bind.dialect.name.
+"""
+
+from sqlalchemy import Date, cast, extract, func
+
+GROUP_BY_UNITS = ("day", "week", "month")
+
+
+def seconds_between(dialect: str, start, end):
+    """Seconds from start to end. The time_worked column_property subtracts the
+    columns directly, which SQLite does for the text of the dates"""
+    if dialect == "postgresql":
+        return extract("epoch", end - start)
+    return (func.julianday(end) - func.julianday(start)) * 86400
+
+
+def period_start(dialect: str, column, group_by: str):
+    """The first day of the day, week (starting monday) or month of a date"""
+    if dialect == "postgresql":
+        return cast(func.date_trunc(group_by, column), Date)
+    if group_by == "week":
+        # Move to the next sunday, unless already a sunday, then back to monday
+        return func.date(column, "weekday 0", "-6 days")
+    if group_by == "month":
+        return func.strftime("%Y-%m-01", column)
+    return func.date(column)
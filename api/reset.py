@@ -0,0 +1,106 @@
+"""
+Emptying the database and restoring named snapshots of it.
+
+reset_database removes every row in one statement per table, TRUNCATE with
+RESTART IDENTITY on Postgres and DELETE on SQLite, where the ids restart by
+themselves once a table is empty. The table versions are bumped instead of
+removed, so ETags handed out before the reset no longer match.
+
+Snapshots copies a SQLite database with the backup API, which copies the
+pages of the database instead of inserting its rows, so a database seeded once
+is restored far faster than it is seeded again.
+"""
+
+import os
+import sqlite3
+from typing import Optional
+from sqlalchemy import Connection, Engine, delete, text
+from api import models
+from api.database import Base
+from api.etags import version_bumps
+from api.migrations import schema_migrations
+
+# Kept by a reset, the schema is not changed by it
+KEPT_TABLES = (models.TableVersion.__tablename__, schema_migrations.name)
+
+
+def data_tables() -> list:
+    """The tables with data, children before their parents"""
+    return [
+        table
+        for table in reversed(Base.metadata.sorted_tables)
+        if table.name not in KEPT_TABLES
+    ]
+
+
+def reset_database(conn: Connection):
+    """Removes all rows and restarts the ids, call in a transaction"""
+    tables = data_tables()
+    if conn.dialect.name == "postgresql":
+        names = ", ".join(table.name for table in tables)
+        conn.execute(text(f"TRUNCATE {names} RESTART IDENTITY"))
+    else:
+        for table in tables:
+            conn.execute(delete(table))
+        # Only tables declared with AUTOINCREMENT have a sequence to reset
+        if conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'"
+        ).first():
+            conn.exec_driver_sql("DELETE FROM sqlite_sequence")
+    for statement in version_bumps(
+        conn.dialect.name, tuple(table.name for table in tables)
+    ):
+        conn.execute(statement)
+
+
+class Snapshots:
+    """Named copies of the SQLite database of a sync engine, kept in memory or
+    as files in a directory when one is given. Clear the entity cache after a
+    restore, it may hold rows the snapshot does not have"""
+
+    def __init__(self, engine: Engine, directory: Optional[str] = None):
+        if engine.dialect.name != "sqlite":
+            raise ValueError("Snapshots are only supported on SQLite")
+        self.engine = engine
+        self.directory = directory
+        self.in_memory: dict[str, sqlite3.Connection] = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.db")
+
+    def __contains__(self, name: str) -> bool:
+        if self.directory is None:
+            return name in self.in_memory
+        return os.path.exists(self.path(name))
+
+    def save(self, name: str):
+        """Saves the database under the name, replacing an earlier snapshot"""
+        if self.directory is None:
+            target = self.in_memory.get(name) or sqlite3.connect(":memory:")
+            self.in_memory[name] = target
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            target = sqlite3.connect(self.path(name))
+        raw = self.engine.raw_connection()
+        try:
+            raw.driver_connection.backup(target)
+        finally:
+            raw.close()
+            if self.directory is not None:
+                target.close()
+
+    def restore(self, name: str):
+        """Replaces the database with the snapshot of the name"""
+        if name not in self:
+            raise KeyError(f"No snapshot named {name}")
+        if self.directory is None:
+            source = self.in_memory[name]
+        else:
+            source = sqlite3.connect(self.path(name))
+        raw = self.engine.raw_connection()
+        try:
+            source.backup(raw.driver_connection)
+        finally:
+            raw.close()
+            if self.directory is not None:
+                source.close()
@@ -1,11 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
-from api.schemas import Overtime, OvertimeOut
+from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
+from api.schemas import BulkResult, CursorPage, LookupResult, Overtime, OvertimeOut
 from api import models
+from api.bulk import insert_overtimes, validate_items
+from api.cache import cache, overtime_key
+from api.etags import OVERTIMES, SHIFTS, bump_versions, conditional_get
+from api.summary import SummaryDelta
 from dependencies import get_db, get_api_key
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import select
-from fastapi_pagination.ext.sqlalchemy import paginate
+from fastapi_pagination import pagination_ctx
 from fastapi_pagination.links import Page
+from typing import Any, Optional
+from api.helpers import (
+    lookup_by_ids,
+    overtimes_of_shift,
+    paginate_by_cursor,
+    paginate_with_total,
+    parse_ids,
+)
+from api.serialization import parse_fields, pick_fields
 
 router = APIRouter(
     prefix="/overtime",
@@ -17,34 +31,117 @@ router = APIRouter(
 
 @router.post("")
 async def create_overtime(
-    overtime: Overtime, db: Session = Depends(get_db)
+    overtime: Overtime, db: AsyncSession = Depends(get_db)
 ) -> Overtime:
     """Create overtime for a shift and adds it to the database"""
     db_overtime = models.Overtime(
         type=overtime.type, hours=overtime.hours, shift_id=overtime.shift_id
     )
     db.add(db_overtime)
-    db.commit()
-    db.refresh(db_overtime)
+
+    shift = await db.get(models.Shift, overtime.shift_id)
+    if shift:
+        summary = SummaryDelta()
+        summary.add_overtime(shift.person_id, shift.start_time, overtime.hours)
+        await summary.apply(db)
+
+    await bump_versions(db, OVERTIMES)
+    await db.commit()
+    await db.refresh(db_overtime)
+
+    await cache.invalidate(overtime_key(overtime.shift_id))
 
     return overtime
 
 
-@router.get("")
-async def get_all_overtimes(db: Session = Depends(get_db)) -> Page[OvertimeOut]:
-    """Get all overtimes from the database"""
-    return paginate(db, select(models.Overtime))
+@router.post("/bulk")
+async def create_overtimes(
+    items: list[Any] = Body(), db: AsyncSession = Depends(get_db)
+) -> BulkResult:
+    """Create many overtimes in a single transaction, items that fail validation
+    are reported by their index and the rest are inserted"""
+    valid, errors = validate_items(items, Overtime)
+    inserted, insert_errors = await insert_overtimes(db, valid)
+    await db.commit()
+
+    await cache.invalidate(*{overtime_key(overtime.shift_id) for _, overtime in valid})
 
+    return BulkResult(
+        inserted=inserted,
+        errors=sorted(errors + insert_errors, key=lambda error: error.index),
+    )
+
+
+@router.get(
+    "",
+    dependencies=[
+        Depends(pagination_ctx(Page[OvertimeOut])),
+        Depends(conditional_get(OVERTIMES)),
+    ],
+)
+async def get_all_overtimes(
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    shift_ids: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+) -> Page[OvertimeOut] | CursorPage[OvertimeOut] | LookupResult[OvertimeOut]:
+    """Get all overtimes from the database. Passing a cursor (empty for the first page)
+    switches to keyset pagination and returns a CursorPage with a next_cursor instead.
+    Pass a comma separated list of fields to only select and return those. Passing
+    comma separated shift_ids returns a LookupResult with the overtimes of those
+    shifts in the same order instead"""
+    names = parse_fields(fields, OvertimeOut)
+    query = select(*models.Overtime.__table__.columns)
+
+    if shift_ids is not None:
+        return await lookup_by_ids(
+            db,
+            query,
+            models.Overtime.shift_id,
+            parse_ids(shift_ids),
+            OvertimeOut,
+            names,
+        )
 
-@router.get("/{shift_id}")
+    if cursor is not None:
+        return await paginate_by_cursor(
+            db, query, [models.Overtime.shift_id], "asc", cursor, OvertimeOut, names
+        )
+
+    return await paginate_with_total(
+        db, query.order_by(models.Overtime.shift_id), OvertimeOut, names
+    )
+
+
+@router.post("/lookup")
+async def lookup_overtimes(
+    shift_ids: list[int] = Body(),
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+) -> LookupResult[OvertimeOut]:
+    """Get the overtimes of a list of shift ids too long for a query string, in
+    the same order, along with the shift ids without an overtime"""
+    return await lookup_by_ids(
+        db,
+        select(*models.Overtime.__table__.columns),
+        models.Overtime.shift_id,
+        list(dict.fromkeys(shift_ids)),
+        OvertimeOut,
+        parse_fields(fields, OvertimeOut),
+    )
+
+
+@router.get("/{shift_id}", dependencies=[Depends(conditional_get(OVERTIMES, SHIFTS))])
 async def get_overtime_by_shift(
-    shift_id: int, db: Session = Depends(get_db)
+    shift_id: int, fields: Optional[str] = None, db: AsyncSession = Depends(get_db)
 ) -> list[OvertimeOut]:
-    """Get overtime to corresponding shift from the database"""
-    shift = db.query(models.Shift).filter(models.Shift.id == shift_id).first()
+    """Get overtime to corresponding shift from the cache or the database. Pass a
+    comma separated list of fields to only return those"""
+    names = parse_fields(fields, OvertimeOut)
 
-    if shift:
-        return (
-            db.query(models.Overtime).filter(models.Overtime.shift_id == shift_id).all()
-        )
+    overtimes = await cache.get_or_load(
+        overtime_key(shift_id), lambda: overtimes_of_shift(db, shift_id)
+    )
+    if overtimes is not None:
+        return ORJSONResponse([pick_fields(overtime, names) for overtime in overtimes])
     raise HTTPException(status_code=404, detail="Shift not found")
@@ -1,14 +1,42 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
-from api.schemas import Person, PersonOut, ShiftOut
+from fastapi import APIRouter, Body, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from api.schemas import (
+    BulkResult,
+    ImportResult,
+    CursorPage,
+    LookupResult,
+    Person,
+    PersonOut,
+    ShiftOut,
+)
 from api import models
+from api.imports import import_stream
+from api.bulk import batches, insert_persons, validate_items
+from api.cache import cache, overtime_key, person_key, shift_key
+from api.etags import OVERTIMES, PERSONS, SHIFTS, bump_versions, conditional_get
 from dependencies import get_db, get_api_key
-from sqlalchemy.orm import Session
-from typing import Optional, Dict
-from fastapi_pagination.ext.sqlalchemy import paginate
-from fastapi_pagination import paginate as pag
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import delete, select, update
+from typing import Any, Optional, Dict
+from fastapi_pagination import pagination_ctx
+from api.search import index_person, unindex_person
+from api.serialization import parse_fields, pick_fields
+from api.summary import delete_person_summary
 from fastapi_pagination.links import Page
-from api.helpers import generate_display_tag, person_search, shift_join_with_person_id
+from api.helpers import (
+    SHIFT_INCLUDES,
+    add_person,
+    lookup_by_ids,
+    paginate_by_cursor,
+    paginate_with_total,
+    parse_ids,
+    parse_include,
+    person_search_filter,
+    person_search_rank,
+    shift_join_with_person_id,
+    sort_query_by,
+)
 
 router = APIRouter(
     prefix="/person",
@@ -21,50 +49,100 @@ router = APIRouter(
 @router.post("")
 async def create_person(
     person: Person,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> Person:
     """Create a new person and adds it to the database"""
-    first_name = person.first_name
-    last_name = person.last_name
-    display_tag = generate_display_tag(person, db)
-
-    db_person = models.Person(
-        first_name=first_name,
-        last_name=last_name,
-        display_tag=display_tag,
-        job_role=person.job_role,
-        birthday=person.birthday,
-    )
-    db.add(db_person)
-    db.commit()
-    db.refresh(db_person)
+    db_person = await add_person(person, db)
+    await index_person(db, db_person.id, person.first_name, person.last_name)
+    await bump_versions(db, PERSONS)
+    await db.commit()
 
     return person
 
 
-@router.get("/{person_id}")
-async def get_person_by_id(person_id: int, db: Session = Depends(get_db)) -> PersonOut:
-    """Get a person by person_id from the database"""
-    person = db.query(models.Person).filter(models.Person.id == person_id).first()
+@router.post("/bulk")
+async def create_persons(
+    items: list[Any] = Body(), db: AsyncSession = Depends(get_db)
+) -> BulkResult:
+    """Create many persons in a single transaction, items that fail validation
+    are reported by their index and the rest are inserted"""
+    valid, errors = validate_items(items, Person)
+    inserted, insert_errors = await insert_persons(db, valid)
+    await db.commit()
+
+    return BulkResult(
+        inserted=inserted,
+        errors=sorted(errors + insert_errors, key=lambda error: error.index),
+    )
+
+
+@router.post("/import")
+async def import_persons(
+    request: Request, db: AsyncSession = Depends(get_db)
+) -> ImportResult:
+    """Import persons from an NDJSON body, or a CSV body with a header row when the
+    content type is text/csv. The body is streamed and inserted in committed
+    batches, rejected records are reported by their position in the file"""
+    return await import_stream(
+        db,
+        request.stream(),
+        request.headers.get("content-type", ""),
+        Person,
+        insert_persons,
+    )
+
 
+@router.get("/{person_id}", dependencies=[Depends(conditional_get(PERSONS))])
+async def get_person_by_id(
+    person_id: int, fields: Optional[str] = None, db: AsyncSession = Depends(get_db)
+) -> PersonOut:
+    """Get a person by person_id from the cache or the database. Pass a comma
+    separated list of fields to only return those"""
+    names = parse_fields(fields, PersonOut)
+
+    async def load_person():
+        person = await db.get(models.Person, person_id)
+        if person:
+            return PersonOut.model_validate(person, from_attributes=True).model_dump()
+
+    person = await cache.get_or_load(person_key(person_id), load_person)
     if person:
-        return person
+        return ORJSONResponse(pick_fields(person, names))
     raise HTTPException(status_code=404, detail="Person not found")
 
 
-@router.get("")
+@router.get(
+    "",
+    dependencies=[
+        Depends(pagination_ctx(Page[PersonOut])),
+        Depends(conditional_get(PERSONS)),
+    ],
+)
 async def get_all_persons(
     search_string: Optional[str] = None,
     order_type: Optional[str] = None,
     sort_by: Optional[str] = None,
-    db: Session = Depends(get_db),
-) -> Page[PersonOut]:
-    """Get persons from the database using regex-like matching on first and/or last name"""
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    ids: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+) -> Page[PersonOut] | CursorPage[PersonOut] | LookupResult[PersonOut]:
+    """Get persons from the database using regex-like matching on first and/or last name.
+    Passing a cursor (empty for the first page) switches to keyset pagination and
+    returns a CursorPage with a next_cursor instead. Pass a comma separated list
+    of fields to only select and return those. Passing comma separated ids returns
+    a LookupResult with those persons in the same order instead"""
+    names = parse_fields(fields, PersonOut)
     # main query
-    query = db.query(models.Person)
+    query = select(*models.Person.__table__.columns)
+
+    if ids is not None:
+        return await lookup_by_ids(
+            db, query, models.Person.id, parse_ids(ids), PersonOut, names
+        )
 
     if search_string:
-        query = person_search(search_string, db)
+        query = query.filter(person_search_filter(search_string))
 
     sort_by_map = {
         "last_name": models.Person.last_name,
@@ -73,71 +151,142 @@ async def get_all_persons(
 
     attribute = sort_by_map.get(sort_by)
 
-    # If attribute is not None, apply the sorting
-    if attribute:
-        if order_type == "asc":
-            query = query.order_by(attribute.asc())
-        elif order_type == "desc":
-            query = query.order_by(attribute.desc())
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Order type is either asc or desc, you entered {order_type}",
+    if cursor is not None:
+        if attribute is None:
+            return await paginate_by_cursor(
+                db, query, [models.Person.id], "asc", cursor, PersonOut, names
             )
-    return paginate(db, query)
+        return await paginate_by_cursor(
+            db,
+            query,
+            [attribute, models.Person.id],
+            order_type,
+            cursor,
+            PersonOut,
+            names,
+        )
+
+    if search_string and attribute is None:
+        # Best matches first when no other order is requested
+        query = query.order_by(person_search_rank(search_string))
+
+    # If attribute is not None, apply the sorting
+    query = sort_query_by(query, attribute, order_type, models.Person.id)
+
+    return await paginate_with_total(db, query, PersonOut, names)
+
+
+@router.post("/lookup")
+async def lookup_persons(
+    ids: list[int] = Body(),
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+) -> LookupResult[PersonOut]:
+    """Get the persons of a list of ids too long for a query string, in the same
+    order, along with the ids that were not found"""
+    return await lookup_by_ids(
+        db,
+        select(*models.Person.__table__.columns),
+        models.Person.id,
+        list(dict.fromkeys(ids)),
+        PersonOut,
+        parse_fields(fields, PersonOut),
+    )
 
 
 @router.put("/{person_id}")
 async def update_person(
-    person: Person, person_id: int, db: Session = Depends(get_db)
+    person: Person, person_id: int, db: AsyncSession = Depends(get_db)
 ) -> Person:
     """Update a person in the database"""
-    p = db.query(models.Person).filter(models.Person.id == person_id).first()
+    p = await db.get(models.Person, person_id)
 
     if p:
-        db.query(models.Person).filter(models.Person.id == person_id).update(
-            {
-                "first_name": person.first_name,
-                "last_name": person.last_name,
-                "job_role": person.job_role,
-                "birthday": person.birthday,
-            }
+        await db.execute(
+            update(models.Person)
+            .filter(models.Person.id == person_id)
+            .values(
+                first_name=person.first_name,
+                last_name=person.last_name,
+                job_role=person.job_role,
+                birthday=person.birthday,
+            )
+        )
+        await index_person(db, person_id, person.first_name, person.last_name)
+        shift_ids = (
+            await db.scalars(
+                select(models.Shift.id).filter(models.Shift.person_id == person_id)
+            )
+        ).all()
+        await bump_versions(db, PERSONS)
+        await db.commit()
+
+        # The cached shifts include the name of the person
+        await cache.invalidate(
+            person_key(person_id), *(shift_key(id) for id in shift_ids)
         )
-        db.commit()
         return person
     raise HTTPException(status_code=404, detail="Person not found")
 
 
-@router.get("/{person_id}/shift")
+@router.get(
+    "/{person_id}/shift",
+    dependencies=[Depends(conditional_get(PERSONS, SHIFTS, OVERTIMES))],
+)
 async def get_shifts(
     person_id: int,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     sort_by: Optional[str] = None,
     order_type: Optional[str] = None,
-    db: Session = Depends(get_db),
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
 ) -> Page[ShiftOut]:
-    """Get all shifts for a person from the database"""
-    p = db.query(models.Person).filter(models.Person.id == person_id).first()
+    """Get all shifts for a person from the database, limited to the comma
+    separated fields if given. Pass include=overtime to embed the overtimes"""
+    names = parse_fields(fields, ShiftOut)
+    includes = parse_include(include, SHIFT_INCLUDES)
+    p = await db.get(models.Person, person_id)
 
     if p:
-        shifts = shift_join_with_person_id(
-            person_id, db, start_date, end_date, sort_by, order_type
+        shift_query = shift_join_with_person_id(
+            person_id, start_date, end_date, sort_by, order_type
         )
-        return pag(shifts)
+        return await paginate_with_total(db, shift_query, ShiftOut, names, includes)
     raise HTTPException(status_code=404, detail="Person not found")
 
 
 @router.delete("/{person_id}")
 async def delete_person(
-    person_id: int, db: Session = Depends(get_db)
+    person_id: int, db: AsyncSession = Depends(get_db)
 ) -> Dict[str, str]:
-    """Delete a person along with their shifts (if any) from the database"""
-    p = db.query(models.Person).filter(models.Person.id == person_id).first()
+    """Delete a person along with their shifts and overtimes from the database"""
+    p = await db.get(models.Person, person_id)
 
     if p:
-        db.query(models.Shift).filter(models.Shift.person_id == person_id).delete()
-        db.query(models.Person).filter(models.Person.id == person_id).delete()
-        db.commit()
+        shift_ids = (
+            await db.scalars(
+                select(models.Shift.id).filter(models.Shift.person_id == person_id)
+            )
+        ).all()
+        for batch in batches(shift_ids):
+            await db.execute(
+                delete(models.Overtime).filter(models.Overtime.shift_id.in_(batch))
+            )
+        await db.execute(
+            delete(models.Shift).filter(models.Shift.person_id == person_id)
+        )
+        await unindex_person(db, person_id)
+        await delete_person_summary(db, person_id)
+        await db.execute(delete(models.Person).filter(models.Person.id == person_id))
+        await bump_versions(db, PERSONS, SHIFTS, OVERTIMES)
+        await db.commit()
+
+        await cache.invalidate(
+            person_key(person_id),
+            *(shift_key(id) for id in shift_ids),
+            *(overtime_key(id) for id in shift_ids),
+        )
         return {"message": "Person deleted successfully"}
     raise HTTPException(status_code=404, detail="Person not found")
@@ -0,0 +1,90 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from api.schemas import PersonHours
+from api import models
+from dependencies import get_db, get_api_key
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import select
+from typing import Optional
+from api.reports import GROUP_BY_UNITS, period_start
+from api.etags import OVERTIMES, PERSONS, SHIFTS, conditional_get
+
+router = APIRouter(
+    prefix="/report",
+    tags=["Report"],
+    dependencies=[Depends(get_api_key)],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get(
+    "/hours", dependencies=[Depends(conditional_get(PERSONS, SHIFTS, OVERTIMES))]
+)
+async def get_hours_report(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    group_by: str = "day",
+    person_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+) -> list[PersonHours]:
+    """Get the hours worked and the overtime hours per person, summed over the
+    shifts starting in each day, week or month of the period. Reads the daily
+    summary maintained by the write routes instead of the shifts"""
+    if group_by not in GROUP_BY_UNITS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Group by is either day, week or month, you entered {group_by}",
+        )
+
+    summary = models.PersonDailyHours
+    period = period_start(db.bind.dialect.name, summary.day, group_by).label("period")
+
+    query = (
+        select(
+            summary.person_id,
+            models.Person.first_name,
+            models.Person.last_name,
+            period,
+            func.sum(summary.shift_count).label("shift_count"),
+            func.sum(summary.seconds_worked).label("seconds_worked"),
+            func.sum(summary.overtime_hours).label("overtime_hours"),
+        )
+        .join(models.Person, summary.person_id == models.Person.id)
+        .group_by(
+            summary.person_id,
+            models.Person.first_name,
+            models.Person.last_name,
+            period,
+        )
+        .order_by(summary.person_id, period)
+    )
+    # The date filters select whole days, which the summary rows are
+    if start_date:
+        query = query.filter(summary.day >= start_date.date())
+    if end_date:
+        query = query.filter(summary.day <= end_date.date())
+    if person_id is not None:
+        query = query.filter(summary.person_id == person_id)
+
+    report = {}
+    for row in await db.execute(query):
+        person = report.setdefault(
+            row.person_id,
+            {
+                "person_id": row.person_id,
+                "first_name": row.first_name,
+                "last_name": row.last_name,
+                "buckets": [],
+            },
+        )
+        person["buckets"].append(
+            {
+                "period": row.period,
+                "shift_count": row.shift_count,
+                "hours_worked": round(row.seconds_worked / 3600, 2),
+                "overtime_hours": row.overtime_hours,
+            }
+        )
+
+    return list(report.values())
@@ -1,16 +1,40 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
-from api.schemas import ShiftOut, Shift
+from fastapi import APIRouter, Body, Depends, HTTPException, Request
+from api.schemas import (
+    BulkResult,
+    ImportResult,
+    CursorPage,
+    LookupResult,
+    ShiftOut,
+    Shift,
+)
 from api import models
+from api.imports import import_stream
+from api.exports import EXPORT_MEDIA_TYPES, stream_rows
+from api.bulk import insert_shifts, validate_items
+from api.cache import cache, overtime_key, shift_key
+from api.etags import OVERTIMES, PERSONS, SHIFTS, bump_versions, conditional_get
+from api.serialization import parse_fields, pick_fields
+from api.summary import SummaryDelta, overtime_hours
 from dependencies import get_api_key, get_db
-from sqlalchemy.orm import Session, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import delete, update
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi_pagination import pagination_ctx
 from fastapi_pagination.links import Page
-from typing import Optional, Dict
-from fastapi_pagination import paginate
+from typing import Any, Optional, Dict
 from api.helpers import (
+    SHIFT_INCLUDES,
     apply_date_filters,
-    person_search,
+    lookup_by_ids,
+    overtimes_of_shift,
+    paginate_by_cursor,
+    paginate_with_total,
+    parse_ids,
+    parse_include,
+    person_search_filter,
     shift_join_with_shift_id,
+    shift_with_person_select,
     sort_query_by,
 )
 
@@ -23,7 +47,7 @@ router = APIRouter(
 
 
 @router.post("")
-async def create_shift(shift: Shift, db: Session = Depends(get_db)) -> Shift:
+async def create_shift(shift: Shift, db: AsyncSession = Depends(get_db)) -> Shift:
     """Create a new shift for a person and adds it to the database"""
     if shift.start_time > shift.end_time:
         raise HTTPException(
@@ -37,74 +61,206 @@ async def create_shift(shift: Shift, db: Session = Depends(get_db)) -> Shift:
         person_id=shift.person_id,
     )
     db.add(db_shift)
-    db.commit()
-    db.refresh(db_shift)
+
+    summary = SummaryDelta()
+    summary.add_shift(shift.person_id, shift.start_time, shift.end_time)
+    await summary.apply(db)
+
+    await bump_versions(db, SHIFTS)
+    await db.commit()
+    await db.refresh(db_shift)
     return shift
 
 
-@router.get("")
+@router.post("/bulk")
+async def create_shifts(
+    items: list[Any] = Body(), db: AsyncSession = Depends(get_db)
+) -> BulkResult:
+    """Create many shifts in a single transaction, items that fail validation
+    are reported by their index and the rest are inserted"""
+    valid, errors = validate_items(items, Shift)
+    inserted, insert_errors = await insert_shifts(db, valid)
+    await db.commit()
+
+    return BulkResult(
+        inserted=inserted,
+        errors=sorted(errors + insert_errors, key=lambda error: error.index),
+    )
+
+
+@router.post("/import")
+async def import_shifts(
+    request: Request, db: AsyncSession = Depends(get_db)
+) -> ImportResult:
+    """Import shifts from an NDJSON body, or a CSV body with a header row when the
+    content type is text/csv. The body is streamed and inserted in committed
+    batches, rejected records are reported by their position in the file"""
+    return await import_stream(
+        db,
+        request.stream(),
+        request.headers.get("content-type", ""),
+        Shift,
+        insert_shifts,
+    )
+
+
+@router.get(
+    "",
+    dependencies=[
+        Depends(pagination_ctx(Page[ShiftOut])),
+        Depends(conditional_get(PERSONS, SHIFTS, OVERTIMES)),
+    ],
+)
 async def get_all_shifts(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     order_type: Optional[str] = None,
     sort_by: Optional[str] = None,
     search_string: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-) -> Page[ShiftOut]:
-    """Get shifts from the database"""
-    if search_string:
-        query = person_search(search_string, db)
-    else:
-        query = db.query(models.Person)
-
-    # Create a subquery to select the first name and id from the Person table
-    subquery = query.with_entities(models.Person.id, models.Person.first_name).subquery()
-    person_alias = aliased(models.Person, subquery)
-
-    # Create the main query using the Shift table
-    shift_query = (
-        db.query(models.Shift)
-        .join(
-            person_alias, models.Shift.person_id == person_alias.id
-        )  # Join with the aliased subquery
-        .filter(
-            models.Shift.person_id.in_(db.query(person_alias.id))
-        )  # Filter to include only those in the subquery
-    )
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    ids: Optional[str] = None,
+) -> Page[ShiftOut] | CursorPage[ShiftOut] | LookupResult[ShiftOut]:
+    """Get shifts from the database. Passing a cursor (empty for the first page)
+    switches to keyset pagination and returns a CursorPage with a next_cursor instead.
+    Pass a comma separated list of fields to only select and return those, and
+    include=overtime to embed the overtimes of the shifts. Passing comma separated
+    ids returns a LookupResult with those shifts in the same order instead"""
+    names = parse_fields(fields, ShiftOut)
+    includes = parse_include(include, SHIFT_INCLUDES)
+    shift_query = shift_with_person_select()
+
+    if ids is not None:
+        return await lookup_by_ids(
+            db,
+            shift_query,
+            models.Shift.id,
+            parse_ids(ids),
+            ShiftOut,
+            names,
+            includes,
+        )
 
-    if sort_by == "first_name":
-        shift_query = sort_query_by(shift_query, person_alias.first_name, order_type)
-    elif sort_by == "start_time":
-        shift_query = sort_query_by(shift_query, models.Shift.start_time, order_type)
+    if search_string:
+        shift_query = shift_query.filter(person_search_filter(search_string))
 
     shift_query = apply_date_filters(shift_query, start_date, end_date)
 
-    unjoined_shifts = shift_query.all()
+    sort_by_map = {
+        "first_name": models.Person.first_name,
+        "start_time": models.Shift.start_time,
+    }
+
+    attribute = sort_by_map.get(sort_by)
 
-    shifts = []
-    for shift in unjoined_shifts:
-        shift = shift_join_with_shift_id(shift.id, db)
-        if shift is not None:
-            shifts.append(shift)
+    if cursor is not None:
+        if attribute is None:
+            return await paginate_by_cursor(
+                db,
+                shift_query,
+                [models.Shift.id],
+                "asc",
+                cursor,
+                ShiftOut,
+                names,
+                includes,
+            )
+        return await paginate_by_cursor(
+            db,
+            shift_query,
+            [attribute, models.Shift.id],
+            order_type,
+            cursor,
+            ShiftOut,
+            names,
+            includes,
+        )
 
-    return paginate(shifts)
+    shift_query = sort_query_by(shift_query, attribute, order_type, models.Shift.id)
 
+    return await paginate_with_total(db, shift_query, ShiftOut, names, includes)
 
-@router.get("/{shift_id}")
-async def get_shift_by_id(shift_id: int, db: Session = Depends(get_db)):
-    """Get a shift by shift_id from the database"""
-    shift = db.query(models.Shift).filter(models.Shift.id == shift_id).first()
-    if shift:
-        joined_shift = shift_join_with_shift_id(shift_id, db)
-        if joined_shift:
-            return joined_shift
+
+@router.post("/lookup")
+async def lookup_shifts(
+    ids: list[int] = Body(),
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+) -> LookupResult[ShiftOut]:
+    """Get the shifts of a list of ids too long for a query string, in the same
+    order, along with the ids that were not found"""
+    return await lookup_by_ids(
+        db,
+        shift_with_person_select(),
+        models.Shift.id,
+        list(dict.fromkeys(ids)),
+        ShiftOut,
+        parse_fields(fields, ShiftOut),
+        parse_include(include, SHIFT_INCLUDES),
+    )
+
+
+@router.get("/export")
+async def export_shifts(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    format: str = "csv",
+    db: AsyncSession = Depends(get_db),
+) -> StreamingResponse:
+    """Export the shifts of a period joined with the person name as CSV or NDJSON.
+    The rows are streamed from a server-side cursor in a single query"""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format is either csv or ndjson, you entered {format}",
+        )
+
+    shift_query = apply_date_filters(shift_with_person_select(), start_date, end_date)
+    shift_query = shift_query.order_by(models.Shift.start_time, models.Shift.id)
+
+    return StreamingResponse(
+        stream_rows(db.bind, shift_query, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="shifts.{format}"'},
+    )
+
+
+@router.get(
+    "/{shift_id}", dependencies=[Depends(conditional_get(PERSONS, SHIFTS, OVERTIMES))]
+)
+async def get_shift_by_id(
+    shift_id: int,
+    fields: Optional[str] = None,
+    include: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Get a shift by shift_id from the cache or the database. Pass a comma
+    separated list of fields to only return those, and include=overtime to embed
+    the overtimes of the shift"""
+    names = parse_fields(fields, ShiftOut)
+    includes = parse_include(include, SHIFT_INCLUDES)
+    joined_shift = await cache.get_or_load(
+        shift_key(shift_id), lambda: shift_join_with_shift_id(shift_id, db)
+    )
+    if joined_shift:
+        item = pick_fields(joined_shift, names)
+        if includes:
+            item["overtimes"] = await cache.get_or_load(
+                overtime_key(shift_id), lambda: overtimes_of_shift(db, shift_id)
+            )
+        return ORJSONResponse(item)
     raise HTTPException(status_code=404, detail="Shift not found")
 
 
 @router.put("/{shift_id}")
-async def update_shift(shift: Shift, shift_id, db: Session = Depends(get_db)) -> Shift:
+async def update_shift(
+    shift: Shift, shift_id: int, db: AsyncSession = Depends(get_db)
+) -> Shift:
     """Update a shift in the database"""
-    s = db.query(models.Shift).filter(models.Shift.id == shift_id).first()
+    s = await db.get(models.Shift, shift_id)
 
     if shift.start_time > shift.end_time:
         raise HTTPException(
@@ -112,25 +268,52 @@ async def update_shift(shift: Shift, shift_id, db: Session = Depends(get_db)) ->
         )
 
     if s:
-        db.query(models.Shift).filter(models.Shift.id == shift_id).update(
-            {
-                "start_time": shift.start_time,
-                "end_time": shift.end_time,
-                "comment": shift.comment,
-            }
+        # Move the shift in the summary before the update refreshes s
+        hours = await overtime_hours(db, shift_id)
+        summary = SummaryDelta()
+        summary.remove_shift(s.person_id, s.start_time, s.end_time, hours)
+        summary.add_shift(s.person_id, shift.start_time, shift.end_time, hours)
+        await summary.apply(db)
+
+        await db.execute(
+            update(models.Shift)
+            .filter(models.Shift.id == shift_id)
+            .values(
+                start_time=shift.start_time,
+                end_time=shift.end_time,
+                comment=shift.comment,
+            )
         )
-        db.commit()
+        await bump_versions(db, SHIFTS)
+        await db.commit()
+
+        await cache.invalidate(shift_key(shift_id))
         return shift
     raise HTTPException(status_code=404, detail="Shift not found")
 
 
 @router.delete("/{shift_id}")
-async def delete_shift(shift_id: int, db: Session = Depends(get_db)) -> Dict[str, str]:
-    """Delete a shift from the database"""
-    s = db.query(models.Shift).filter(models.Shift.id == shift_id).first()
+async def delete_shift(
+    shift_id: int, db: AsyncSession = Depends(get_db)
+) -> Dict[str, str]:
+    """Delete a shift along with its overtime (if any) from the database"""
+    s = await db.get(models.Shift, shift_id)
 
     if s:
-        db.query(models.Shift).filter(models.Shift.id == shift_id).delete()
-        db.commit()
+        summary = SummaryDelta()
+        summary.remove_shift(
+            s.person_id, s.start_time, s.end_time, await overtime_hours(db, shift_id)
+        )
+        await summary.apply(db)
+
+        # A later shift can reuse the id, it must not inherit the overtime
+        await db.execute(
+            delete(models.Overtime).filter(models.Overtime.shift_id == shift_id)
+        )
+        await db.execute(delete(models.Shift).filter(models.Shift.id == shift_id))
+        await bump_versions(db, SHIFTS, OVERTIMES)
+        await db.commit()
+
+        await cache.invalidate(shift_key(shift_id), overtime_key(shift_id))
         return {"message": "Shift deleted successfully"}
     raise HTTPException(status_code=404, detail="Shift not found")
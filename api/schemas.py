@@ -1,6 +1,8 @@
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from datetime import date, datetime
+from typing import Any, Generic, Optional, TypeVar
+
+T = TypeVar("T")
 
 
 class Person(BaseModel):
@@ -69,3 +71,44 @@ class OvertimeOut(BaseModel):
     field_C: str | None
     field_D: str | None
     field_E: str | None
+
+
+class CursorPage(BaseModel, Generic[T]):
+    items: list[T]
+    size: int
+    next_cursor: str | None
+
+
+class LookupResult(BaseModel, Generic[T]):
+    items: list[T]
+    missing: list[int]
+
+
+class BulkError(BaseModel):
+    index: int
+    detail: Any
+
+
+class BulkResult(BaseModel):
+    inserted: int
+    errors: list[BulkError]
+
+
+class ImportResult(BaseModel):
+    inserted: int
+    rejected: int
+    errors: list[BulkError]
+
+
+class HoursBucket(BaseModel):
+    period: date
+    shift_count: int
+    hours_worked: float
+    overtime_hours: int
+
+
+class PersonHours(BaseModel):
+    person_id: int
+    first_name: str
+    last_name: str
+    buckets: list[HoursBucket]
@@ -0,0 +1,84 @@
+"""
+Trigram search over the names of persons.
+
+Every lowercased first and last name is split into its three character
+substrings, stored in the person_trigrams table. A search term of three or more
+characters can only be a substring of a name containing all of its trigrams, so
+the candidates are found with an indexed lookup and only they are matched with
+LIKE. Shorter terms have no trigrams and fall back to LIKE alone.
+"""
+
+from sqlalchemy import and_, case, delete, func, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from api import models
+
+NAME_FIELDS = ("first_name", "last_name")
+
+
+def trigrams(text: str | None) -> set[str]:
+    """Returns the set of lowercased three character substrings of a text"""
+    text = (text or "").lower()
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def person_trigram_rows(person_id: int, first_name: str, last_name: str) -> list:
+    """Rows of person_trigrams indexing the names of a person"""
+    return [
+        {"trigram": trigram, "field": field, "person_id": person_id}
+        for field, name in zip(NAME_FIELDS, (first_name, last_name))
+        for trigram in trigrams(name)
+    ]
+
+
+async def index_person(
+    db: AsyncSession, person_id: int, first_name: str, last_name: str
+):
+    """Replaces the trigrams of a person, call in the transaction changing the names"""
+    await unindex_person(db, person_id)
+    rows = person_trigram_rows(person_id, first_name, last_name)
+    if rows:
+        await db.execute(insert(models.PersonTrigram), rows)
+
+
+async def unindex_person(db: AsyncSession, person_id: int):
+    """Removes the trigrams of a person"""
+    await db.execute(
+        delete(models.PersonTrigram).filter(models.PersonTrigram.person_id == person_id)
+    )
+
+
+def name_match_filter(term: str, fields: tuple[str, ...]):
+    """Filter clause matching persons with the term as a substring of any of
+    the given name fields"""
+    like = or_(
+        *[
+            func.lower(getattr(models.Person, field)).like(f"%{term.lower()}%")
+            for field in fields
+        ]
+    )
+    term_trigrams = trigrams(term)
+    if not term_trigrams:
+        return like
+
+    # Persons with all trigrams of the term in one of the fields
+    candidates = (
+        select(models.PersonTrigram.person_id)
+        .filter(
+            models.PersonTrigram.trigram.in_(term_trigrams),
+            models.PersonTrigram.field.in_(fields),
+        )
+        .group_by(models.PersonTrigram.person_id, models.PersonTrigram.field)
+        .having(func.count() == len(term_trigrams))
+    )
+    return and_(models.Person.id.in_(candidates), like)
+
+
+def name_match_rank(term: str, fields: tuple[str, ...]):
+    """Rank of a match, 0 for an exact name, 1 for a prefix, 2 for a substring"""
+    names = [func.lower(getattr(models.Person, field)) for field in fields]
+    term = term.lower()
+    return case(
+        (or_(*[name == term for name in names]), 0),
+        (or_(*[name.like(f"{term}%") for name in names]), 1),
+        else_=2,
+    )
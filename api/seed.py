@@ -0,0 +1,260 @@
+"""
+Generation of realistic test data written with bulk inserts.
+
+Rows are generated from a seeded random generator, so the same options give
+the same data, and inserted with executemany in batches of SeedOptions.batch_size
+directly through the engine instead of through the API. The trigrams, the
+display tags, the daily hours summary and the table versions are kept
+consistent with the rows, as the API would have left them.
+"""
+
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple, Optional, TextIO
+from sqlalchemy import Connection, func, insert, select, text
+from api import models
+from api.etags import OVERTIMES, PERSONS, SHIFTS, version_bumps
+from api.helpers import display_tag_prefix
+from api.search import person_trigram_rows
+from api.summary import rebuild_summary
+
+FIRST_NAMES = [
+    "Darth", "Obi-Wan", "Anakin", "Leia", "Kylo", "Boba", "Han", "Ahsoka",
+    "Luke", "Padme", "Lando", "Rey", "Finn", "Poe", "Mace", "Qui-Gon",
+]  # fmt: skip
+LAST_NAMES = [
+    "Vader", "Kenobi", "Skywalker", "Organa", "Ren", "Fett", "Solo", "Tano",
+    "Amidala", "Calrissian", "Dameron", "Windu", "Jinn", "Andor", "Erso",
+]  # fmt: skip
+JOB_ROLES = ["Bartender", "Kock", "Servitör", "Chef", "Hovmästare", "Bagare"]
+OVERTIME_TYPES = ["Kompledigt", "Betald"]
+
+
+class SeedOptions(NamedTuple):
+    persons: int = 1000
+    shifts: int = 100_000
+    seed: int = 1
+    start_date: datetime = datetime(2023, 1, 1)
+    end_date: datetime = datetime(2025, 1, 1)
+    # Shift lengths in hours are normally distributed and rounded to quarters
+    mean_hours: float = 8
+    stddev_hours: float = 1.5
+    min_hours: float = 2
+    max_hours: float = 12
+    # Share of the shifts starting in the evening and ending after midnight
+    overnight_share: float = 0.1
+    # Share of the shifts with overtime, of 1 to max_overtime_hours hours
+    overtime_share: float = 0.25
+    max_overtime_hours: int = 4
+    batch_size: int = 10_000
+
+
+class Progress:
+    """Prints the rows inserted so far and the throughput"""
+
+    def __init__(self, out: Optional[TextIO] = sys.stdout):
+        self.out = out
+        self.start = time.perf_counter()
+        self.rows = Counter()
+
+    def add(self, table: str, rows: int, total: int):
+        self.rows[table] += rows
+        if self.out is not None:
+            seconds = time.perf_counter() - self.start
+            self.out.write(
+                f"\r{table}: {self.rows[table]}/{total}"
+                f" ({sum(self.rows.values()) / seconds:,.0f} rows/s)"
+            )
+            self.out.flush()
+
+    def done(self, table: str):
+        if self.out is not None:
+            self.out.write(f"\r{table}: {self.rows[table]} rows".ljust(60) + "\n")
+
+
+def batched(rows: Iterator[dict], size: int) -> Iterator[list[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def next_id(conn: Connection, column) -> int:
+    return (conn.scalar(select(func.max(column))) or 0) + 1
+
+
+def person_rows(
+    rng: random.Random, first_id: int, count: int, taken_tags: set[str]
+) -> Iterator[tuple[dict, list[dict]]]:
+    """Persons with unique display tags, along with the rows of their trigrams"""
+    suffixes = Counter()
+    for person_id in range(first_id, first_id + count):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        prefix = display_tag_prefix(first_name, last_name)
+        # The three digit suffixes first, then four digits and so on
+        while True:
+            n, digits = suffixes[prefix], 3
+            suffixes[prefix] += 1
+            while n >= 9 * 10 ** (digits - 1):
+                n -= 9 * 10 ** (digits - 1)
+                digits += 1
+            tag = prefix + str(10 ** (digits - 1) + n)
+            if tag not in taken_tags:
+                break
+        person = {
+            "id": person_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "job_role": rng.choice(JOB_ROLES),
+            "birthday": datetime(1960, 1, 1) + timedelta(days=rng.randrange(16000)),
+            "display_tag": tag,
+        }
+        yield person, person_trigram_rows(person_id, first_name, last_name)
+
+
+def shift_rows(
+    rng: random.Random, options: SeedOptions, first_id: int, person_ids: list[int]
+) -> Iterator[dict]:
+    # random() and gauss() directly, randint() and choice() cost several
+    # times more per call
+    uniform, gauss = rng.random, rng.gauss
+    days = max((options.end_date - options.start_date).days, 1)
+    created_at = datetime.now()
+    for shift_id in range(first_id, first_id + options.shifts):
+        if uniform() < options.overnight_share:
+            hour = 18 + int(uniform() * 5)
+        else:
+            hour = 6 + int(uniform() * 9)
+        start_time = options.start_date + timedelta(
+            days=int(uniform() * days), hours=hour, minutes=15 * int(uniform() * 4)
+        )
+        hours = gauss(options.mean_hours, options.stddev_hours)
+        hours = round(min(max(hours, options.min_hours), options.max_hours) * 4) / 4
+        if hour >= 18:
+            # Overnight shifts always end after midnight
+            hours = max(hours, 24 - hour + 0.25)
+        yield {
+            "id": shift_id,
+            "start_time": start_time,
+            "end_time": start_time + timedelta(hours=hours),
+            "person_id": person_ids[int(uniform() * len(person_ids))],
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+
+
+def overtime_rows(
+    rng: random.Random, options: SeedOptions, shift_ids: range
+) -> Iterator[dict]:
+    uniform = rng.random
+    created_at = datetime.now()
+    for shift_id in shift_ids:
+        if uniform() < options.overtime_share:
+            yield {
+                "shift_id": shift_id,
+                "type": OVERTIME_TYPES[int(uniform() * len(OVERTIME_TYPES))],
+                "hours": 1 + int(uniform() * options.max_overtime_hours),
+                "created_at": created_at,
+                "updated_at": created_at,
+            }
+
+
+def insert_batches(
+    conn: Connection,
+    table,
+    rows: Iterator[dict],
+    total: int,
+    options: SeedOptions,
+    progress: Progress,
+) -> int:
+    inserted = 0
+    for batch in batched(rows, options.batch_size):
+        conn.execute(insert(table), batch)
+        inserted += len(batch)
+        progress.add(table.name, len(batch), total)
+    progress.done(table.name)
+    return inserted
+
+
+def reset_sequences(conn: Connection, tables: list):
+    """Moves the Postgres id sequences past the ids inserted explicitly"""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in tables:
+        conn.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'),"
+                f" (SELECT coalesce(max(id), 1) FROM {table.name}))"
+            )
+        )
+
+
+def seed(
+    conn: Connection,
+    options: SeedOptions,
+    progress: Optional[Progress] = None,
+) -> dict[str, int]:
+    """Adds the persons, shifts and overtimes to the rows already in the
+    database, call in a transaction. Returns the number of rows per table"""
+    progress = progress or Progress(out=None)
+    if conn.dialect.name == "sqlite":
+        # The indexes of the shifts outgrow the default 2 MB page cache, after
+        # which every insert reads pages back from disk
+        conn.exec_driver_sql("PRAGMA cache_size = -262144")
+    elif conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET LOCAL synchronous_commit = off")
+    rng = random.Random(options.seed)
+    persons = models.Person.__table__
+    shifts = models.Shift.__table__
+    overtimes = models.Overtime.__table__
+    trigrams = models.PersonTrigram.__table__
+
+    first_person = next_id(conn, persons.c.id)
+    taken_tags = set(conn.scalars(select(persons.c.display_tag)))
+    counts = Counter()
+    for batch in batched(
+        person_rows(rng, first_person, options.persons, taken_tags),
+        options.batch_size,
+    ):
+        conn.execute(insert(persons), [person for person, _ in batch])
+        conn.execute(insert(trigrams), [row for _, rows in batch for row in rows])
+        counts[PERSONS] += len(batch)
+        progress.add(PERSONS, len(batch), options.persons)
+    progress.done(PERSONS)
+
+    person_ids = list(conn.scalars(select(persons.c.id)))
+    if options.shifts and not person_ids:
+        raise ValueError("Shifts need persons, add some first")
+    first_shift = next_id(conn, shifts.c.id)
+    counts[SHIFTS] = insert_batches(
+        conn,
+        shifts,
+        shift_rows(rng, options, first_shift, person_ids),
+        options.shifts,
+        options,
+        progress,
+    )
+    shift_ids = range(first_shift, first_shift + options.shifts)
+    counts[OVERTIMES] = insert_batches(
+        conn,
+        overtimes,
+        overtime_rows(rng, options, shift_ids),
+        round(options.shifts * options.overtime_share),
+        options,
+        progress,
+    )
+
+    reset_sequences(conn, [persons, shifts])
+    rebuild_summary(conn)
+    # Invalidates the ETags handed out before the new rows
+    for statement in version_bumps(conn.dialect.name, (PERSONS, SHIFTS, OVERTIMES)):
+        conn.execute(statement)
+    return dict(counts)
@@ -0,0 +1,126 @@
+"""
+Incremental maintenance of the person_daily_hours summary table.
+
+Every route that changes shifts or overtimes collects the change per person
+and day in a SummaryDelta and applies it with an upsert in the same
+transaction, so the summary is always consistent with the shifts.
+rebuild_summary recomputes the whole table from the shifts.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import Integer, cast, delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from api import models
+from api.reports import seconds_between
+
+
+class SummaryDelta:
+    """Changes to the shift count, seconds worked and overtime hours per person and day"""
+
+    def __init__(self):
+        self.changes = defaultdict(lambda: [0, 0, 0])
+
+    def add_shift(
+        self,
+        person_id: int,
+        start_time: datetime,
+        end_time: datetime,
+        overtime_hours: int = 0,
+        sign: int = 1,
+    ):
+        change = self.changes[(person_id, start_time.date())]
+        change[0] += sign
+        change[1] += sign * round((end_time - start_time).total_seconds())
+        change[2] += sign * (overtime_hours or 0)
+
+    def remove_shift(self, person_id, start_time, end_time, overtime_hours=0):
+        self.add_shift(person_id, start_time, end_time, overtime_hours, sign=-1)
+
+    def add_overtime(self, person_id: int, start_time: datetime, hours: int):
+        self.changes[(person_id, start_time.date())][2] += hours or 0
+
+    async def apply(self, db: AsyncSession):
+        """Upserts the changes, call before committing the transaction"""
+        rows = [
+            {
+                "person_id": person_id,
+                "day": day,
+                "shift_count": shift_count,
+                "seconds_worked": seconds_worked,
+                "overtime_hours": overtime_hours,
+            }
+            for (person_id, day), (
+                shift_count,
+                seconds_worked,
+                overtime_hours,
+            ) in self.changes.items()
+            if shift_count or seconds_worked or overtime_hours
+        ]
+        if not rows:
+            return
+
+        dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+        table = models.PersonDailyHours.__table__
+        upsert = dialect.insert(table)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c.person_id, table.c.day],
+            set_={
+                column: table.c[column] + upsert.excluded[column]
+                for column in ("shift_count", "seconds_worked", "overtime_hours")
+            },
+        )
+        await db.execute(upsert, rows)
+
+        # Days left without shifts
+        await db.execute(
+            delete(table).filter(
+                table.c.person_id.in_({row["person_id"] for row in rows}),
+                table.c.shift_count <= 0,
+            )
+        )
+
+
+async def overtime_hours(db: AsyncSession, shift_id: int) -> int:
+    """The overtime hours of a shift, 0 when it has no overtime"""
+    hours = await db.scalar(
+        select(models.Overtime.hours).filter(models.Overtime.shift_id == shift_id)
+    )
+    return hours or 0
+
+
+async def delete_person_summary(db: AsyncSession, person_id: int):
+    await db.execute(
+        delete(models.PersonDailyHours).filter(
+            models.PersonDailyHours.person_id == person_id
+        )
+    )
+
+
+def rebuild_summary(conn: Connection):
+    """Recomputes the summary from the shifts and overtimes in one statement"""
+    seconds = seconds_between(
+        conn.dialect.name, models.Shift.start_time, models.Shift.end_time
+    )
+    summary = (
+        select(
+            models.Shift.person_id,
+            func.date(models.Shift.start_time).label("day"),
+            func.count(models.Shift.id),
+            func.sum(cast(func.round(seconds), Integer)),
+            func.coalesce(func.sum(models.Overtime.hours), 0),
+        )
+        .outerjoin(models.Overtime, models.Overtime.shift_id == models.Shift.id)
+        .group_by(models.Shift.person_id, func.date(models.Shift.start_time))
+    )
+
+    table = models.PersonDailyHours.__table__
+    conn.execute(delete(table))
+    conn.execute(
+        insert(table).from_select(
+            ["person_id", "day", "shift_count", "seconds_worked", "overtime_hours"],
+            summary,
+        )
+    )
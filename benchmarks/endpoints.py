@@ -0,0 +1,498 @@
+"""
+Benchmark of every route on a seeded database of realistic size.
+
+Seeds a SQLite database with api/seed.py, or reuses the one seeded by a
+previous run with the same options, and runs the app on a copy of it through
+a TestClient. Every scenario sends
+REQUESTS requests with filters, sorting, search strings and deep pages drawn
+from a seeded random generator, and reports the p50 and p95 latency, the SQL
+statements per request and the peak memory allocated by one request. The
+results are written to a JSON file, which --compare compares to the results
+of another commit.
+
+    python -m benchmarks.endpoints --output results.json
+    python -m benchmarks.endpoints --output new.json --compare results.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from api.database import Base, TimedQueuePool, pool_options
+from api.helpers import encode_cursor
+from api.instrumentation import capture_queries, instrument_engine
+from api.migrations import run_migrations
+from api.seed import FIRST_NAMES, JOB_ROLES, LAST_NAMES, Progress, SeedOptions, seed
+from dependencies import get_db
+from main import app
+
+FIRST_DAY = SeedOptions().start_date
+DAYS = (SeedOptions().end_date - FIRST_DAY).days
+PAGE_SIZE = 50
+# Untimed requests before each scenario
+WARMUP = 2
+# The last shifts get no overtime so the write scenarios can add some
+SPARE_SHIFTS = 10_000
+
+
+class Dataset(NamedTuple):
+    persons: int
+    shifts: int
+    overtime_share: float
+    seed: int
+
+
+def seed_database(path: str, dataset: Dataset):
+    """Creates the schema and fills it with api/seed.py"""
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    spare = min(SPARE_SHIFTS, dataset.shifts // 10)
+    with engine.begin() as conn:
+        progress = Progress()
+        seed(
+            conn,
+            SeedOptions(
+                persons=dataset.persons,
+                shifts=dataset.shifts - spare,
+                overtime_share=dataset.overtime_share,
+                seed=dataset.seed,
+            ),
+            progress,
+        )
+        seed(
+            conn,
+            SeedOptions(persons=0, shifts=spare, overtime_share=0, seed=dataset.seed),
+            progress,
+        )
+    engine.dispose()
+
+
+def seeded_database(dataset: Dataset, reseed: bool = False) -> str:
+    """Path of a database seeded with the dataset, seeded once and reused"""
+    name = "shift-benchmark-{}-{}-{}-{}.db".format(*dataset)
+    path = os.path.join(tempfile.gettempdir(), name)
+    if reseed or not os.path.exists(path):
+        start = time.perf_counter()
+        seed_database(path + ".tmp", dataset)
+        os.replace(path + ".tmp", path)
+        print(f"seeded {path} in {time.perf_counter() - start:.1f} s")
+    return path
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    # Returns the keyword arguments of TestClient.request from a random generator
+    request: Callable[[random.Random], dict]
+
+
+def day(rng: random.Random) -> datetime:
+    return FIRST_DAY + timedelta(days=rng.randrange(DAYS))
+
+
+def scenarios(dataset: Dataset) -> list[Scenario]:
+    persons, shifts = dataset.persons, dataset.shifts
+    overtimes = round(shifts * dataset.overtime_share)
+
+    def person_id(rng):
+        return rng.randint(1, persons)
+
+    def shift_id(rng):
+        return rng.randint(1, shifts)
+
+    def new_shift(rng):
+        start_time = day(rng) + timedelta(hours=8)
+        return {
+            "start_time": start_time.isoformat(),
+            "end_time": (start_time + timedelta(hours=8)).isoformat(),
+            "person_id": person_id(rng),
+        }
+
+    def new_person(rng):
+        return {
+            "first_name": rng.choice(FIRST_NAMES),
+            "last_name": rng.choice(LAST_NAMES),
+            "job_role": rng.choice(JOB_ROLES),
+        }
+
+    def week(rng):
+        first = day(rng)
+        return f"start_date={first.isoformat()}&end_date={(first + timedelta(days=7)).isoformat()}"
+
+    def ndjson(items):
+        return {
+            "content": "\n".join(json.dumps(item) for item in items),
+            "headers": {"content-type": "application/x-ndjson"},
+        }
+
+    # Taken from the end so every overtime is added to a spare shift and every
+    # delete finds its row
+    spare_persons = iter(range(persons, 0, -1))
+    spare_shifts = iter(range(shifts, 0, -1))
+
+    return [
+        Scenario("persons page", "GET", lambda r: {"url": f"/person?size={PAGE_SIZE}"}),
+        Scenario(
+            "persons deep page",
+            "GET",
+            lambda r: {
+                "url": f"/person?size={PAGE_SIZE}&page={max(persons // PAGE_SIZE - r.randint(0, 10), 1)}"
+            },
+        ),
+        Scenario(
+            "persons sorted",
+            "GET",
+            lambda r: {
+                "url": f"/person?size={PAGE_SIZE}&sort_by=last_name&order_type={r.choice(['asc', 'desc'])}"
+            },
+        ),
+        Scenario(
+            "persons search",
+            "GET",
+            lambda r: {
+                "url": f"/person?size={PAGE_SIZE}&search_string={r.choice(LAST_NAMES)[:4].lower()}"
+            },
+        ),
+        Scenario(
+            "persons search short term",
+            "GET",
+            lambda r: {"url": f"/person?size={PAGE_SIZE}&search_string=an"},
+        ),
+        Scenario(
+            "persons by cursor",
+            "GET",
+            lambda r: {
+                "url": f"/person?size={PAGE_SIZE}&cursor={encode_cursor([person_id(r)])}"
+            },
+        ),
+        Scenario("person by id", "GET", lambda r: {"url": f"/person/{person_id(r)}"}),
+        Scenario(
+            "person by ids",
+            "GET",
+            lambda r: {
+                "url": "/person?ids=" + ",".join(str(person_id(r)) for _ in range(50))
+            },
+        ),
+        Scenario(
+            "person lookup",
+            "POST",
+            lambda r: {
+                "url": "/person/lookup",
+                "json": [person_id(r) for _ in range(500)],
+            },
+        ),
+        Scenario(
+            "shifts of person",
+            "GET",
+            lambda r: {
+                "url": f"/person/{person_id(r)}/shift?sort_by=start_time&order_type=desc&include=overtime"
+            },
+        ),
+        Scenario("shifts page", "GET", lambda r: {"url": f"/shift?size={PAGE_SIZE}"}),
+        Scenario(
+            "shifts deep page",
+            "GET",
+            lambda r: {
+                "url": f"/shift?size={PAGE_SIZE}&page={max(shifts // PAGE_SIZE - r.randint(0, 10), 1)}"
+            },
+        ),
+        Scenario(
+            "shifts of a week",
+            "GET",
+            lambda r: {
+                "url": f"/shift?size={PAGE_SIZE}&sort_by=start_time&order_type=asc&{week(r)}"
+            },
+        ),
+        Scenario(
+            "shifts search",
+            "GET",
+            lambda r: {
+                "url": f"/shift?size={PAGE_SIZE}&search_string={r.choice(FIRST_NAMES)[:4].lower()}"
+            },
+        ),
+        Scenario(
+            "shifts with overtime",
+            "GET",
+            lambda r: {
+                "url": f"/shift?size={PAGE_SIZE}&include=overtime&fields=id,start_time,end_time"
+            },
+        ),
+        Scenario(
+            "shifts by cursor",
+            "GET",
+            lambda r: {
+                "url": f"/shift?size={PAGE_SIZE}&include=overtime&cursor={encode_cursor([shift_id(r)])}"
+            },
+        ),
+        Scenario("shift by id", "GET", lambda r: {"url": f"/shift/{shift_id(r)}"}),
+        Scenario(
+            "shift lookup",
+            "POST",
+            lambda r: {
+                "url": "/shift/lookup?include=overtime",
+                "json": [shift_id(r) for _ in range(500)],
+            },
+        ),
+        Scenario("shifts export", "GET", lambda r: {"url": f"/shift/export?{week(r)}"}),
+        Scenario(
+            "overtimes page", "GET", lambda r: {"url": f"/overtime?size={PAGE_SIZE}"}
+        ),
+        Scenario(
+            "overtimes deep page",
+            "GET",
+            lambda r: {
+                "url": f"/overtime?size={PAGE_SIZE}&page={max(overtimes // PAGE_SIZE - r.randint(0, 10), 1)}"
+            },
+        ),
+        Scenario(
+            "overtime of shift", "GET", lambda r: {"url": f"/overtime/{shift_id(r)}"}
+        ),
+        Scenario(
+            "overtime lookup",
+            "POST",
+            lambda r: {
+                "url": "/overtime/lookup",
+                "json": [shift_id(r) for _ in range(500)],
+            },
+        ),
+        Scenario(
+            "hours report by week",
+            "GET",
+            lambda r: {
+                "url": f"/report/hours?group_by=week&start_date={day(r).isoformat()}&end_date={(day(r) + timedelta(days=90)).isoformat()}"
+            },
+        ),
+        Scenario(
+            "hours report of person",
+            "GET",
+            lambda r: {"url": f"/report/hours?group_by=month&person_id={person_id(r)}"},
+        ),
+        Scenario(
+            "create person", "POST", lambda r: {"url": "/person", "json": new_person(r)}
+        ),
+        Scenario(
+            "update person",
+            "PUT",
+            lambda r: {"url": f"/person/{person_id(r)}", "json": new_person(r)},
+        ),
+        Scenario(
+            "create persons bulk",
+            "POST",
+            lambda r: {
+                "url": "/person/bulk",
+                "json": [new_person(r) for _ in range(100)],
+            },
+        ),
+        Scenario(
+            "import persons",
+            "POST",
+            lambda r: {
+                "url": "/person/import",
+                **ndjson(new_person(r) for _ in range(1000)),
+            },
+        ),
+        Scenario(
+            "create shift", "POST", lambda r: {"url": "/shift", "json": new_shift(r)}
+        ),
+        Scenario(
+            "update shift",
+            "PUT",
+            lambda r: {"url": f"/shift/{shift_id(r)}", "json": new_shift(r)},
+        ),
+        Scenario(
+            "create shifts bulk",
+            "POST",
+            lambda r: {
+                "url": "/shift/bulk",
+                "json": [new_shift(r) for _ in range(100)],
+            },
+        ),
+        Scenario(
+            "import shifts",
+            "POST",
+            lambda r: {
+                "url": "/shift/import",
+                **ndjson(new_shift(r) for _ in range(1000)),
+            },
+        ),
+        Scenario(
+            "create overtime",
+            "POST",
+            lambda r: {
+                "url": "/overtime",
+                "json": {
+                    "type": "Overtime",
+                    "hours": 2,
+                    "shift_id": next(spare_shifts),
+                },
+            },
+        ),
+        Scenario(
+            "create overtimes bulk",
+            "POST",
+            lambda r: {
+                "url": "/overtime/bulk",
+                "json": [
+                    {"type": "Overtime", "hours": 2, "shift_id": next(spare_shifts)}
+                    for _ in range(100)
+                ],
+            },
+        ),
+        Scenario(
+            "delete shift", "DELETE", lambda r: {"url": f"/shift/{next(spare_shifts)}"}
+        ),
+        Scenario(
+            "delete person",
+            "DELETE",
+            lambda r: {"url": f"/person/{next(spare_persons)}"},
+        ),
+    ]
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest rank percentile"""
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def run_scenario(
+    client: TestClient, scenario: Scenario, rng: random.Random, requests: int
+) -> dict:
+    headers = {"access_token": os.environ.get("API_KEY", "")}
+    for _ in range(WARMUP):
+        kwargs = scenario.request(rng)
+        kwargs["headers"] = {**headers, **kwargs.get("headers", {})}
+        client.request(scenario.method, **kwargs)
+
+    seconds, errors = [], 0
+    with capture_queries() as stats:
+        for _ in range(requests):
+            kwargs = scenario.request(rng)
+            kwargs["headers"] = {**headers, **kwargs.get("headers", {})}
+            start = time.perf_counter()
+            response = client.request(scenario.method, **kwargs)
+            seconds.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    # Memory is traced in a separate request since tracing slows down the others
+    kwargs = scenario.request(rng)
+    kwargs["headers"] = {**headers, **kwargs.get("headers", {})}
+    tracemalloc.start()
+    client.request(scenario.method, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "method": scenario.method,
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(seconds, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 0.95) * 1000, 3),
+        "queries_per_request": round(stats.count / requests, 2),
+        "peak_memory_kib": round(peak / 1024, 1),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\n{'scenario':<28}{'p50 change':>12}{'p95 change':>12}{'queries':>12}")
+    for name, result in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        p50 = (result["p50_ms"] / base["p50_ms"] - 1) * 100
+        p95 = (result["p95_ms"] / base["p95_ms"] - 1) * 100
+        queries = result["queries_per_request"] - base["queries_per_request"]
+        print(f"{name:<28}{p50:>+11.1f}%{p95:>+11.1f}%{queries:>+12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--persons", type=int, default=10_000)
+    parser.add_argument("--shifts", type=int, default=1_000_000)
+    parser.add_argument("--overtime-share", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--only", help="run the scenarios containing this text")
+    parser.add_argument("--reseed", action="store_true")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    args = parser.parse_args()
+
+    # The statements are counted in the results, not logged per request
+    logging.getLogger("api.instrumentation").setLevel(logging.ERROR)
+    dataset = Dataset(args.persons, args.shifts, args.overtime_share, args.seed)
+    # Write scenarios change the data, so every run starts from a fresh copy
+    path = os.path.join(tempfile.gettempdir(), "shift-benchmark-run.db")
+    shutil.copyfile(seeded_database(dataset, args.reseed), path)
+
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}", poolclass=TimedQueuePool, **pool_options()
+    )
+    instrument_engine(engine.sync_engine)
+    session = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    async def get_benchmark_db():
+        async with session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = get_benchmark_db
+    rng = random.Random(args.seed)
+    results = {}
+    with TestClient(app) as client:
+        for scenario in scenarios(dataset):
+            if args.only and args.only not in scenario.name:
+                continue
+            results[scenario.name] = result = run_scenario(
+                client, scenario, rng, args.requests
+            )
+            print(
+                f"{scenario.name:<28}p50 {result['p50_ms']:>9.2f} ms"
+                f"  p95 {result['p95_ms']:>9.2f} ms"
+                f"  {result['queries_per_request']:>6.2f} queries"
+                f"  {result['peak_memory_kib']:>9.1f} KiB"
+                + (f"  {result['errors']} errors" if result["errors"] else "")
+            )
+
+    output = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "dataset": dataset._asdict(),
+        "requests": args.requests,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
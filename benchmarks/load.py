@@ -0,0 +1,385 @@
+"""
+Load test of a running server.
+
+Sends a weighted mix of requests to the person, shift, overtime and report
+routes, either from CONCURRENCY clients sending their next request as soon as
+the last one is answered, or at a fixed RATE of requests per second however
+long they take, and reports the throughput, error rate and latency
+percentiles and histogram of every route. Start the server as it is deployed,
+for example with the command of the Procfile, and seed it with populate.py.
+
+    gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app
+    python -m benchmarks.load --concurrency 32 --duration 30
+    python -m benchmarks.load --rate 200 --duration 30 --mix shifts=3,shift=1
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, Optional
+import httpx
+from dotenv import load_dotenv
+
+# Upper bounds in milliseconds of the buckets of the latency histograms
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, math.inf)
+FIRST_DAY = datetime(2023, 1, 1)
+DAYS = 730
+SEARCH_TERMS = ["sky", "ken", "vad", "lei", "an", "solo", "org"]
+
+
+class Ids(NamedTuple):
+    """Ids of existing rows sampled from the server before the test"""
+
+    persons: list[int]
+    shifts: list[int]
+
+
+class Operation(NamedTuple):
+    # Route the request is reported under
+    route: str
+    method: str
+    # Returns the keyword arguments of AsyncClient.request
+    request: Callable[[random.Random, Ids], dict]
+
+
+def week(rng: random.Random) -> dict:
+    start = FIRST_DAY + timedelta(days=rng.randrange(DAYS))
+    return {
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=7)).isoformat(),
+    }
+
+
+def new_shift(rng: random.Random, ids: Ids) -> dict:
+    start = FIRST_DAY + timedelta(days=rng.randrange(DAYS), hours=rng.randint(6, 14))
+    return {
+        "start_time": start.isoformat(),
+        "end_time": (start + timedelta(hours=8)).isoformat(),
+        "person_id": rng.choice(ids.persons),
+    }
+
+
+OPERATIONS = {
+    "persons": Operation(
+        "GET /person",
+        "GET",
+        lambda r, ids: {
+            "url": "/person",
+            "params": {
+                "size": 50,
+                "page": r.randint(1, 20),
+                "sort_by": "last_name",
+                "order_type": "asc",
+            },
+        },
+    ),
+    "person_search": Operation(
+        "GET /person",
+        "GET",
+        lambda r, ids: {
+            "url": "/person",
+            "params": {"size": 50, "search_string": r.choice(SEARCH_TERMS)},
+        },
+    ),
+    "person": Operation(
+        "GET /person/{person_id}",
+        "GET",
+        lambda r, ids: {"url": f"/person/{r.choice(ids.persons)}"},
+    ),
+    "person_shifts": Operation(
+        "GET /person/{person_id}/shift",
+        "GET",
+        lambda r, ids: {
+            "url": f"/person/{r.choice(ids.persons)}/shift",
+            "params": {
+                "include": "overtime",
+                "sort_by": "start_time",
+                "order_type": "desc",
+            },
+        },
+    ),
+    "shifts": Operation(
+        "GET /shift",
+        "GET",
+        lambda r, ids: {
+            "url": "/shift",
+            "params": {
+                "size": 50,
+                "sort_by": "start_time",
+                "order_type": "asc",
+                **week(r),
+            },
+        },
+    ),
+    "shifts_by_cursor": Operation(
+        "GET /shift",
+        "GET",
+        lambda r, ids: {
+            "url": "/shift",
+            "params": {"size": 50, "cursor": "", "include": "overtime"},
+        },
+    ),
+    "shift": Operation(
+        "GET /shift/{shift_id}",
+        "GET",
+        lambda r, ids: {"url": f"/shift/{r.choice(ids.shifts)}"},
+    ),
+    "shift_lookup": Operation(
+        "POST /shift/lookup",
+        "POST",
+        lambda r, ids: {
+            "url": "/shift/lookup",
+            "json": r.sample(ids.shifts, min(100, len(ids.shifts))),
+        },
+    ),
+    "overtimes": Operation(
+        "GET /overtime",
+        "GET",
+        lambda r, ids: {"url": "/overtime", "params": {"size": 50}},
+    ),
+    "overtime": Operation(
+        "GET /overtime/{shift_id}",
+        "GET",
+        lambda r, ids: {"url": f"/overtime/{r.choice(ids.shifts)}"},
+    ),
+    "report": Operation(
+        "GET /report/hours",
+        "GET",
+        lambda r, ids: {
+            "url": "/report/hours",
+            "params": {"group_by": "day", **week(r)},
+        },
+    ),
+    "create_shift": Operation(
+        "POST /shift",
+        "POST",
+        lambda r, ids: {"url": "/shift", "json": new_shift(r, ids)},
+    ),
+    "update_shift": Operation(
+        "PUT /shift/{shift_id}",
+        "PUT",
+        lambda r, ids: {
+            "url": f"/shift/{r.choice(ids.shifts)}",
+            "json": new_shift(r, ids),
+        },
+    ),
+}
+
+# Mostly reads, writes are left out unless named in --mix
+DEFAULT_MIX = {
+    "persons": 2,
+    "person_search": 2,
+    "person": 4,
+    "person_shifts": 2,
+    "shifts": 4,
+    "shifts_by_cursor": 1,
+    "shift": 4,
+    "shift_lookup": 1,
+    "overtimes": 1,
+    "overtime": 2,
+    "report": 1,
+}
+
+
+def parse_mix(mix: Optional[str]) -> dict[str, float]:
+    """Parses name=weight pairs separated by commas"""
+    if not mix:
+        return DEFAULT_MIX
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name}, use {', '.join(OPERATIONS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.statuses = defaultdict(int)
+
+    def record(self, seconds: float, status: Optional[int]):
+        self.latencies.append(seconds * 1000)
+        self.statuses[str(status or "error")] += 1
+        if status is None or status >= 400:
+            self.errors += 1
+
+    def percentile(self, fraction: float) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[max(math.ceil(fraction * len(latencies)) - 1, 0)]
+
+    def histogram(self) -> dict[str, int]:
+        counts = [0] * len(BUCKETS)
+        for latency in self.latencies:
+            counts[next(i for i, le in enumerate(BUCKETS) if latency <= le)] += 1
+        return {f"le_{le}": count for le, count in zip(BUCKETS, counts)}
+
+    def summary(self, seconds: float) -> dict:
+        count = len(self.latencies)
+        return {
+            "requests": count,
+            "throughput": round(count / seconds, 2),
+            "error_rate": round(self.errors / count, 4),
+            "statuses": dict(self.statuses),
+            "p50_ms": round(self.percentile(0.5), 2),
+            "p95_ms": round(self.percentile(0.95), 2),
+            "p99_ms": round(self.percentile(0.99), 2),
+            "max_ms": round(max(self.latencies), 2),
+            "histogram_ms": self.histogram(),
+        }
+
+
+async def sample_ids(client: httpx.AsyncClient, rng: random.Random) -> Ids:
+    """Ids from a few random pages of persons and shifts"""
+
+    async def sample(url: str) -> list[int]:
+        first = (await client.get(url, params={"size": 100})).raise_for_status()
+        pages = max(first.json()["pages"] or 1, 1)
+        ids = [item["id"] for item in first.json()["items"]]
+        for page in rng.sample(range(1, pages + 1), min(pages, 10)):
+            response = await client.get(url, params={"size": 100, "page": page})
+            ids += [item["id"] for item in response.raise_for_status().json()["items"]]
+        if not ids:
+            raise SystemExit(f"No rows at {url}, seed the database with populate.py")
+        return sorted(set(ids))
+
+    return Ids(await sample("/person"), await sample("/shift"))
+
+
+async def send(
+    client: httpx.AsyncClient,
+    operation: Operation,
+    rng: random.Random,
+    ids: Ids,
+    stats: dict[str, RouteStats],
+    start: Optional[float] = None,
+):
+    start = start or time.perf_counter()
+    try:
+        response = await client.request(operation.method, **operation.request(rng, ids))
+        status = response.status_code
+    except httpx.HTTPError:
+        status = None
+    stats[operation.route].record(time.perf_counter() - start, status)
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    operations = [OPERATIONS[name] for name in mix]
+    weights = list(mix.values())
+    stats = defaultdict(RouteStats)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        headers={"access_token": args.api_key or ""},
+        limits=limits,
+        timeout=args.timeout,
+    ) as client:
+        try:
+            ids = await sample_ids(client, rng)
+        except httpx.HTTPError as e:
+            raise SystemExit(f"Could not sample ids from {args.url}: {e!r}")
+        start = time.perf_counter()
+        deadline = start + args.duration
+
+        def next_operation() -> Operation:
+            return rng.choices(operations, weights)[0]
+
+        if args.rate:
+            # Open model, requests are started on schedule whether or not the
+            # earlier ones are answered, up to CONCURRENCY at a time
+            slots = asyncio.Semaphore(args.concurrency)
+            tasks = set()
+
+            async def scheduled(operation: Operation):
+                # Timed from the schedule, so waiting for a slot counts too
+                scheduled_at = time.perf_counter()
+                async with slots:
+                    await send(client, operation, rng, ids, stats, scheduled_at)
+
+            sent = 0
+            while time.perf_counter() < deadline:
+                task = asyncio.create_task(scheduled(next_operation()))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                sent += 1
+                await asyncio.sleep(
+                    max(start + sent / args.rate - time.perf_counter(), 0)
+                )
+            await asyncio.gather(*tasks)
+        else:
+            # Closed model, every client waits for its answer before sending
+            async def worker():
+                while time.perf_counter() < deadline:
+                    await send(client, next_operation(), rng, ids, stats)
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+        seconds = time.perf_counter() - start
+
+    total = RouteStats()
+    for route in stats.values():
+        total.latencies += route.latencies
+        total.errors += route.errors
+        for status, count in route.statuses.items():
+            total.statuses[status] += count
+    return {
+        "url": args.url,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "mode": f"rate {args.rate}/s" if args.rate else "closed",
+        "concurrency": args.concurrency,
+        "duration": round(seconds, 2),
+        "mix": mix,
+        "total": total.summary(seconds),
+        "routes": {route: stats[route].summary(seconds) for route in sorted(stats)},
+    }
+
+
+def report(results: dict):
+    print(f"\n{'route':<32}{'req/s':>9}{'errors':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for route, result in [*results["routes"].items(), ("total", results["total"])]:
+        print(
+            f"{route:<32}{result['throughput']:>9.1f}{result['error_rate']:>8.1%}"
+            f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+        )
+    print("\nlatency histogram of all requests (ms)")
+    histogram = results["total"]["histogram_ms"]
+    largest = max(histogram.values()) or 1
+    for bucket, count in histogram.items():
+        print(f"{bucket[3:]:>8} {count:>8} {'#' * round(40 * count / largest)}")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--api-key", default=os.environ.get("API_KEY"))
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="clients, or in flight at a rate"
+    )
+    parser.add_argument("--rate", type=float, help="requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", help=f"name=weight pairs of {', '.join(OPERATIONS)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of the cost per row of serializing a page of shifts.
+
+Compares the default FastAPI path, which validates every row dict against
+ShiftOut, dumps the models and encodes them with the json module, to the fast
+path of api/serialization.py that encodes the row values with orjson.
+
+    python -m benchmarks.serialization
+"""
+
+import json
+import timeit
+from datetime import datetime, timedelta
+from pydantic import TypeAdapter
+from api.schemas import ShiftOut
+from fastapi.responses import ORJSONResponse
+from api.serialization import row_items
+
+ROWS = 1000
+REPEAT = 20
+
+
+class Row:
+    """Stands in for a SQLAlchemy Row, which exposes the columns in _mapping"""
+
+    def __init__(self, mapping: dict):
+        self._mapping = mapping
+
+
+def shift_rows(count: int) -> list[Row]:
+    start = datetime(2024, 1, 1, 8)
+    return [
+        Row(
+            {
+                "id": i,
+                "start_time": start + timedelta(days=i),
+                "end_time": start + timedelta(days=i, hours=8),
+                "created_at": start,
+                "updated_at": start,
+                "person_id": i % 100,
+                "comment": "work",
+                "field_A": "a",
+                "field_B": "b",
+                "field_C": None,
+                "field_D": None,
+                "field_E": None,
+                "first_name": "Anders",
+                "last_name": "Postman",
+            }
+        )
+        for i in range(count)
+    ]
+
+
+def default_path(rows: list[Row], adapter: TypeAdapter) -> bytes:
+    items = adapter.validate_python([dict(row._mapping) for row in rows])
+    return json.dumps(adapter.dump_python(items, mode="json")).encode()
+
+
+def fast_path(rows: list[Row]) -> bytes:
+    return ORJSONResponse(row_items(rows, list(ShiftOut.model_fields))).body
+
+
+def main():
+    rows = shift_rows(ROWS)
+    adapter = TypeAdapter(list[ShiftOut])
+    assert json.loads(default_path(rows, adapter)) == json.loads(fast_path(rows))
+
+    results = {}
+    for name, run in (
+        ("default", lambda: default_path(rows, adapter)),
+        ("fast", lambda: fast_path(rows)),
+    ):
+        seconds = min(timeit.repeat(run, number=1, repeat=REPEAT))
+        results[name] = seconds / ROWS * 1e6
+        print(f"{name:>8}: {results[name]:.2f} µs per row")
+    print(f"speedup: {results['default'] / results['fast']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
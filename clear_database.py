@@ -1,19 +1,13 @@
-from api import models
-from api.database import SessionLocal
+from api.database import engine
+from api.reset import reset_database
 
 """File for clearing database"""
 
 
 def delete_records():
-    """Delete all records in the local database"""
-    db = SessionLocal()
-    try:
-        db.query(models.Overtime).delete()
-        db.query(models.Shift).delete()
-        db.query(models.Person).delete()
-        db.commit()
-    finally:
-        db.close()
+    """Delete all records in the local database and restart the ids"""
+    with engine.begin() as conn:
+        reset_database(conn)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from api.database import SessionLocal
+from api.database import AsyncSessionLocal
 from fastapi.security.api_key import APIKeyHeader
 from fastapi import Security, HTTPException
 from starlette.status import HTTP_403_FORBIDDEN
@@ -6,12 +6,9 @@ from dotenv import load_dotenv
 import os
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 load_dotenv()
@@ -0,0 +1,36 @@
+"""
+Gunicorn settings, read by gunicorn from the working directory.
+
+The schema is created and migrated once before the workers start, otherwise
+every worker tries to apply the same migrations at the same time.
+
+With PROMETHEUS_MULTIPROC_DIR set the workers share their metrics through
+files in that directory, the files of a previous run are removed on start and
+the files of a worker when it exits.
+"""
+
+import os
+import shutil
+
+
+def on_starting(server):
+    from api import models
+    from api.database import engine
+    from api.migrations import run_migrations
+
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    # The workers open their own connections after the fork
+    engine.dispose()
+
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -2,14 +2,22 @@
 Main file for initializing Fast-api app.
 """
 
-from fastapi import FastAPI
-from api.database import engine
+from fastapi import Depends, FastAPI
+from api.database import engine, get_pool_stats
 from api import models
-from api.routers import overtime, person, shift
+from api.cache import cache
+from api.migrations import run_migrations
+from api.routers import overtime, person, report, shift
 from fastapi_pagination import add_pagination
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from api.etags import ETagMiddleware
+from api.instrumentation import QueryStatsMiddleware, query_stats_options
+from api.metrics import METRICS_PATH, MetricsMiddleware, metrics_response
+from dependencies import get_api_key
 
 models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app = FastAPI()
 
@@ -25,6 +33,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ETagMiddleware)
+# Large pages compress well, small bodies are not worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Added last so they are outermost and see the whole request
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryStatsMiddleware, **query_stats_options())
 
 
 @app.get("/")
@@ -32,6 +46,26 @@ async def hello_world():
     return "Hello World!"
 
 
+@app.get("/cache/stats", dependencies=[Depends(get_api_key)])
+async def cache_stats() -> dict[str, dict[str, int]]:
+    """Hits and misses of the entity cache in this worker"""
+    return cache.stats()
+
+
+@app.get("/pool/stats", dependencies=[Depends(get_api_key)])
+async def pool_stats() -> dict[str, float]:
+    """Connections of the database pool in this worker and the time spent
+    waiting for one"""
+    return get_pool_stats()
+
+
+@app.get(METRICS_PATH, include_in_schema=False)
+async def metrics():
+    """Request and database metrics in the Prometheus text format"""
+    return metrics_response()
+
+
 app.include_router(person.router)
 app.include_router(shift.router)
 app.include_router(overtime.router)
+app.include_router(report.router)
@@ -0,0 +1,12 @@
+from api.database import engine
+from api.migrations import run_migrations
+
+"""File for applying the schema migrations to an existing database"""
+
+
+if __name__ == "__main__":
+    applied = run_migrations(engine)
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print("Database is up to date...")
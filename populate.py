@@ -1,149 +1,51 @@
-import requests
-import random
-import datetime
-from dotenv import load_dotenv
-import os
-
-URL = "http://127.0.0.1:8000"
-
-load_dotenv()
-header = {"access_token": os.environ.get("API_KEY")}
-
-
-def ping_application():
-    try:
-        r = requests.get("http://127.0.0.1:8000")
-        if r.status_code == 200:
-            return True
-    except:
-        return False
-
-
-def add_persons(size):
-    """Fill the database with dummy persons"""
-
-    first_names = [
-        "Darth",
-        "Obi-Wan",
-        "Anakin",
-        "Leia",
-        "Kylo",
-        "Boba",
-        "Han",
-        "Ahsoka",
-        "Luke",
-    ]
-
-    last_names = [
-        "Vader",
-        "Kenobi",
-        "Skywalker",
-        "Organa",
-        "Ren",
-        "Fett",
-        "Solo",
-        "Tano",
-    ]
-
-    job_role = ["Bartender", "Kock", "Servitör", "Chef", "Hovmästare", "Bagare"]
-
-    for i in range(size):
-        data = {
-            "first_name": first_names[random.randint(0, len(first_names) - 1)],
-            "last_name": last_names[random.randint(0, len(last_names) - 1)],
-            "job_role": job_role[random.randint(0, len(job_role) - 1)],
-            "birthday": "2024-05-02T20:00:00.000Z",
-        }
-        response = requests.post(f"{URL}/person", json=data, headers=header)
-
-        if response.status_code == 200:
-            print(f"Successfully added person: {i}")
-
-
-def add_shifts(size):
-    """Fill database with dummy shifts"""
-
-    for i in range(size):
-        start_time = datetime.datetime(2024, 1, 30, 8, 0, 0)
-        end_time = datetime.datetime(2024, 1, 30, 17, 0, 0)
-
-        data = {
-            "start_time": start_time.strftime("%Y-%m-%dT%H:%M:%S"),
-            "end_time": end_time.strftime("%Y-%m-%dT%H:%M:%S"),
-            "comment": None,
-            "person_id": i,
-        }
-
-        response = requests.post(f"{URL}/shift", json=data, headers=header)
-
-        if response.status_code == 200:
-            print(f"Successfully added shift: {i}")
-
-    for i in range(size):
-        if i % 3 == 0:
-            start_time = datetime.datetime(2024, 2, 17, 8, 0, 0)
-            end_time = datetime.datetime(2024, 2, 17, 17, 0, 0)
-
-            data1 = {
-                "start_time": start_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "end_time": end_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "comment": "Jobbade 2 timmar övertid",
-                "person_id": i,
-            }
-
-            start_time = datetime.datetime(2024, 5, 1, 10, 0, 0)
-            end_time = datetime.datetime(2024, 5, 1, 19, 0, 0)
-
-            data2 = {
-                "start_time": start_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "end_time": end_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "comment": "Bytte pass med Anakin",
-                "person_id": i,
-            }
-
-            start_time = datetime.datetime(2024, 4, 5, 18, 0, 0)
-            end_time = datetime.datetime(2024, 4, 5, 2, 0, 0)
-
-            data3 = {
-                "start_time": start_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "end_time": end_time.strftime("%Y-%m-%dT%H:%M:%S"),
-                "comment": None,
-                "person_id": i,
-            }
-
-            response1 = requests.post(f"{URL}/shift", json=data1, headers=header)
-            response2 = requests.post(f"{URL}/shift", json=data2, headers=header)
-            response3 = requests.post(f"{URL}/shift", json=data3, headers=header)
-
-            if response1.status_code == 200:
-                print(f"Successfully added shift: {i}")
-
-            if response2.status_code == 200:
-                print(f"Successfully added shift: {i}")
-
-            if response3.status_code == 200:
-                print(f"Successfully added shift: {i}")
-
-
-def add_overtime(size):
-    """Fill every 4th shift in the database with dummy overtimes"""
-    for i in range(size):
-        if i % 4 == 0:
-
-            data = {"type": "Kompledigt", "hours": random.randint(1, 4), "shift_id": i}
-
-            response = requests.post(f"{URL}/overtime", json=data, headers=header)
-
-            if response.status_code == 200:
-                print(f"Successfully added overtime: {i}")
+import argparse
+import time
+from datetime import datetime
+from api import models
+from api.database import engine
+from api.migrations import run_migrations
+from api.seed import Progress, SeedOptions, seed
+
+"""File for filling the database with generated persons, shifts and overtimes.
+The rows are inserted directly with bulk inserts, the application does not
+need to be running"""
+
+
+def parse_args() -> SeedOptions:
+    defaults = SeedOptions()
+    parser = argparse.ArgumentParser(description="Fill the database with test data")
+    parser.add_argument("--persons", type=int, default=defaults.persons)
+    parser.add_argument("--shifts", type=int, default=defaults.shifts)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument(
+        "--start-date", type=datetime.fromisoformat, default=defaults.start_date
+    )
+    parser.add_argument(
+        "--end-date", type=datetime.fromisoformat, default=defaults.end_date
+    )
+    parser.add_argument("--mean-hours", type=float, default=defaults.mean_hours)
+    parser.add_argument("--stddev-hours", type=float, default=defaults.stddev_hours)
+    parser.add_argument("--min-hours", type=float, default=defaults.min_hours)
+    parser.add_argument("--max-hours", type=float, default=defaults.max_hours)
+    parser.add_argument(
+        "--overnight-share", type=float, default=defaults.overnight_share
+    )
+    parser.add_argument("--overtime-share", type=float, default=defaults.overtime_share)
+    parser.add_argument(
+        "--max-overtime-hours", type=int, default=defaults.max_overtime_hours
+    )
+    parser.add_argument("--batch-size", type=int, default=defaults.batch_size)
+    args = parser.parse_args()
+    return SeedOptions(**{field: getattr(args, field) for field in SeedOptions._fields})
 
 
 if __name__ == "__main__":
-    if ping_application():
-        size = int(input("Enter size of database:"))
-        add_persons(size)
-        add_shifts(size)
-        # add_overtime(size) # TODO Remove overtime associated with shifts when a shift is deleted.
-        print("Done")
-    else:
-        print("The application is not running, start it and try again")
+    options = parse_args()
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        counts = seed(conn, options, Progress())
+    seconds = time.perf_counter() - start
+    rows = sum(counts.values())
+    print(f"Added {rows} rows in {seconds:.1f} s ({rows / seconds:,.0f} rows/s)")
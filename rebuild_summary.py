@@ -0,0 +1,10 @@
+from api.database import engine
+from api.summary import rebuild_summary
+
+"""File for rebuilding the daily hours summary from the shifts"""
+
+
+if __name__ == "__main__":
+    with engine.begin() as conn:
+        rebuild_summary(conn)
+    print("Summary rebuilt successfully...")
@@ -0,0 +1,9 @@
+import pytest
+from tests.database import rollback_client
+
+
+@pytest.fixture
+def rolled_back_client():
+    """A TestClient whose writes are rolled back after the test"""
+    with rollback_client() as client:
+        yield client
@@ -0,0 +1,98 @@
+"""
+The database of the tests and a client whose writes are rolled back.
+"""
+
+from contextlib import contextmanager
+from typing import Iterator
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool, StaticPool
+from api.cache import cache
+from api.database import Base
+from api.instrumentation import instrument_engine
+from dependencies import get_db
+from main import app
+
+# A named in-memory database shared between the connections of this process. The
+# sync engine keeps one connection open for the lifetime of the tests so the
+# database is not dropped, and creates the schema. The async engine opens a new
+# connection for every session so no connection outlives the event loop of a request.
+DATABASE_NAME = "file:testdb?mode=memory&cache=shared&uri=true"
+
+schema_engine = create_engine(
+    f"sqlite:///{DATABASE_NAME}",
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+Base.metadata.create_all(bind=schema_engine)
+
+engine = create_async_engine(
+    f"sqlite+aiosqlite:///{DATABASE_NAME}",
+    poolclass=NullPool,
+)
+TestingSessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False
+)
+instrument_engine(engine.sync_engine)
+
+
+async def override_get_db():
+    async with TestingSessionLocal() as db:
+        yield db
+
+
+app.dependency_overrides[get_db] = override_get_db
+
+# The driver starts its transactions lazily and knows nothing of savepoints, so
+# SQLAlchemy emits BEGIN itself on this engine and the commits of the requests
+# release savepoints of the outer transaction instead of committing it
+rollback_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{DATABASE_NAME}",
+    poolclass=NullPool,
+)
+instrument_engine(rollback_engine.sync_engine)
+
+
+@event.listens_for(rollback_engine.sync_engine, "connect")
+def disable_driver_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(rollback_engine.sync_engine, "begin")
+def emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+
+@contextmanager
+def rollback_client() -> Iterator[TestClient]:
+    """A client whose requests share one transaction, rolled back when the
+    block ends. Tests using it leave no rows behind, so they need no cleanup
+    and do not depend on the order they run in"""
+    with TestClient(app) as client:
+
+        async def begin():
+            conn = await rollback_engine.connect()
+            await conn.begin()
+            return conn
+
+        conn = client.portal.call(begin)
+
+        async def rollback_db():
+            async with AsyncSession(
+                bind=conn,
+                join_transaction_mode="create_savepoint",
+                autoflush=False,
+                expire_on_commit=False,
+            ) as db:
+                yield db
+
+        app.dependency_overrides[get_db] = rollback_db
+        try:
+            yield client
+        finally:
+            app.dependency_overrides[get_db] = override_get_db
+            client.portal.call(conn.rollback)
+            client.portal.call(conn.close)
+            # The cache may hold rows that were rolled back
+            client.portal.call(cache.backend.clear)
@@ -0,0 +1,44 @@
+"""
+Test file for the bounded in-process cache backend.
+"""
+
+import asyncio
+from api.cache import Cache, MemoryBackend
+
+
+def test_memory_backend_evicts_least_recently_used():
+    async def run():
+        backend = MemoryBackend(max_entries=2, ttl=60)
+        await backend.set("a", 1)
+        await backend.set("b", 2)
+        assert await backend.get("a") == 1
+        await backend.set("c", 3)
+        return [await backend.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [1, None, 3]
+
+
+def test_memory_backend_expires_entries():
+    async def run():
+        backend = MemoryBackend(max_entries=2, ttl=0)
+        await backend.set("a", 1)
+        return await backend.get("a")
+
+    assert asyncio.run(run()) is None
+
+
+def test_cache_counts_hits_and_misses_without_caching_none():
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return None if len(loads) == 1 else {"id": 1}
+
+    async def run():
+        cache = Cache(MemoryBackend())
+        for _ in range(3):
+            await cache.get_or_load("person:1", load)
+        return cache.stats()
+
+    assert asyncio.run(run()) == {"person": {"hits": 1, "misses": 2}}
+    assert len(loads) == 2
@@ -0,0 +1,33 @@
+"""
+Test file for the connection pool settings.
+"""
+
+import pytest
+from api.database import pool_options, statement_timeout_args
+
+
+def test_pool_defaults():
+    options = pool_options({})
+    assert options["pool_size"] == 5
+    assert options["max_overflow"] == 5
+    assert options["pool_pre_ping"] is True
+
+
+def test_pool_is_sized_per_worker():
+    """Test that the connection budget is divided between the workers"""
+    options = pool_options({"DB_MAX_CONNECTIONS": "20", "WEB_CONCURRENCY": "4"})
+    assert options["pool_size"] + options["max_overflow"] == 5
+    assert options["pool_size"] == 1
+
+    options = pool_options({"DB_MAX_CONNECTIONS": "3", "WEB_CONCURRENCY": "3"})
+    assert (options["pool_size"], options["max_overflow"]) == (1, 0)
+
+    with pytest.raises(ValueError):
+        pool_options({"DB_MAX_CONNECTIONS": "3", "WEB_CONCURRENCY": "4"})
+
+
+def test_statement_timeout():
+    assert statement_timeout_args({}) == {}
+    assert statement_timeout_args({"DB_STATEMENT_TIMEOUT": "5000"}) == {
+        "server_settings": {"statement_timeout": "5000"}
+    }
@@ -2,40 +2,31 @@
 Test file for handling valid and invalid requests made to the database.
 """
 
+import base64
+import json
+import logging
+from contextlib import contextmanager
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
-from api.database import Base
+from sqlalchemy import delete, event, insert, select
+from api.instrumentation import (
+    QueryStats,
+    QueryStatsMiddleware,
+    capture_queries,
+)
+from api import models
+from api.schemas import ShiftOut
+from api.summary import rebuild_summary
 from main import app
+from tests.database import engine, override_get_db, schema_engine
 from dotenv import load_dotenv
 from dependencies import get_db
 import os
 from fastapi_pagination import add_pagination
+from prometheus_client.parser import text_string_to_metric_families
 
 # Note that the name of the function needs to start with 'test' for it to be included in the pytest
 # To ensure the database is filled correctly, put your test function alongside the according http-type(Get, Post, etc.)
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
-)
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base.metadata.create_all(bind=engine)
-
-
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
-        yield db
-    finally:
-        db.close()
-
-
 app.dependency_overrides[get_db] = override_get_db
 add_pagination(app)
 client = TestClient(app)
@@ -44,6 +35,19 @@ load_dotenv()
 header = {"access_token": os.environ.get("API_KEY")}
 
 
+@contextmanager
+def assert_max_queries(maximum: int):
+    """Fails when the requests in the block execute more than maximum statements"""
+    with capture_queries() as stats:
+        yield stats
+    statements = "\n".join(
+        f"{count} x {statement}" for statement, count in stats.statements.items()
+    )
+    assert (
+        stats.count <= maximum
+    ), f"{stats.count} statements, expected at most {maximum}:\n{statements}"
+
+
 def test_hello_world():
     """Test hello world endpoint"""
     response = client.get("/")
@@ -67,6 +71,31 @@ def test_valid_post_person():
     assert response.json() == data
 
 
+def test_valid_post_person_with_full_display_tag_bucket():
+    """Test that a new person gets a longer display_tag when all three digit
+    suffixes of the prefix are taken"""
+    with schema_engine.begin() as conn:
+        conn.execute(
+            insert(models.Person),
+            [
+                {"first_name": "Fulton", "last_name": "Bu", "display_tag": f"fulbu{i}"}
+                for i in range(100, 1000)
+            ],
+        )
+
+    data = {"first_name": "Full", "last_name": "Bucket"}
+    response = client.post("/person", json=data, headers=header)
+    assert response.status_code == 200
+
+    response = client.get("/person?search_string=Full%20Bucket", headers=header)
+    [person] = response.json()["items"]
+    assert person["display_tag"].startswith("fulbu")
+    assert len(person["display_tag"]) == 9
+
+    with schema_engine.begin() as conn:
+        conn.execute(delete(models.Person).filter(models.Person.first_name == "Fulton"))
+
+
 def test_invalid_post_person():
     """Test for creation of person with invalid data/datatypes
     Should give error after a certain character limit?"""
@@ -117,6 +146,110 @@ def test_invalid_post_overtime():
     assert response.json() == data
 
 
+def test_valid_bulk_post():
+    """Test bulk creation of persons, shifts and overtimes with per-item errors"""
+    persons = [
+        {"first_name": "Bulk", "last_name": "Person"},
+        {"first_name": 5},
+        {"first_name": "Bulk", "last_name": "Person"},
+    ]
+    response = client.post("/person/bulk", json=persons, headers=header)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["inserted"] == 2
+    assert [error["index"] for error in result["errors"]] == [1]
+
+    response = client.get("/person?search_string=Bulk%20Person", headers=header)
+    bulk_persons = response.json()["items"]
+    assert len(bulk_persons) == 2
+    assert len({person["display_tag"] for person in bulk_persons}) == 2
+    person_id = bulk_persons[0]["id"]
+
+    shift = {"start_time": "2024-03-01T08:00:00", "end_time": "2024-03-01T16:00:00"}
+    shifts = [
+        {**shift, "person_id": person_id},
+        {**shift, "person_id": 123456},
+        {**shift, "person_id": person_id, "end_time": "2024-02-01T16:00:00"},
+        {**shift, "person_id": person_id, "comment": "second"},
+    ]
+    response = client.post("/shift/bulk", json=shifts, headers=header)
+    result = response.json()
+    assert result["inserted"] == 2
+    assert result["errors"] == [
+        {"index": 1, "detail": "Person not found"},
+        {"index": 2, "detail": "End time cannot be before start time"},
+    ]
+
+    response = client.get(f"/person/{person_id}/shift", headers=header)
+    shift_ids = [shift["id"] for shift in response.json()["items"]]
+    assert len(shift_ids) == 2
+
+    overtimes = [
+        {"type": "Bulk", "hours": 2, "shift_id": shift_ids[0]},
+        {"type": "Bulk", "hours": 3, "shift_id": shift_ids[0]},
+        {"type": "Bulk", "hours": 1, "shift_id": 123456},
+    ]
+    response = client.post("/overtime/bulk", json=overtimes, headers=header)
+    result = response.json()
+    assert result["inserted"] == 1
+    assert result["errors"] == [
+        {"index": 1, "detail": "Shift already has an overtime"},
+        {"index": 2, "detail": "Shift not found"},
+    ]
+
+    for person in bulk_persons:
+        client.delete(f"/person/{person['id']}", headers=header)
+
+
+def test_valid_import():
+    """Test streaming imports of NDJSON persons and CSV shifts"""
+    body = "\n".join(
+        [
+            '{"first_name": "Imported", "last_name": "Person"}',
+            "not json",
+            "",
+            '{"first_name": "Imported"}',
+            '{"first_name": "Imported", "last_name": "Person", "job_role": "Chef"}',
+        ]
+    )
+    response = client.post(
+        "/person/import",
+        content=body,
+        headers={**header, "content-type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["inserted"] == 2
+    assert result["rejected"] == 2
+    assert [error["index"] for error in result["errors"]] == [1, 2]
+
+    response = client.get("/person?search_string=Imported%20Person", headers=header)
+    person_id = response.json()["items"][0]["id"]
+
+    body = (
+        "start_time,end_time,person_id,comment\r\n"
+        f"2024-03-02T08:00:00,2024-03-02T16:00:00,{person_id},\r\n"
+        f'2024-03-03T08:00:00,2024-03-03T16:00:00,{person_id},"two\nlines, quoted"\r\n'
+        "2024-03-04T08:00:00,2024-03-04T16:00:00,123456,\r\n"
+    )
+    response = client.post(
+        "/shift/import",
+        content=body,
+        headers={**header, "content-type": "text/csv"},
+    )
+    result = response.json()
+    assert result["inserted"] == 2
+    assert result["errors"] == [{"index": 2, "detail": "Person not found"}]
+
+    response = client.get(f"/person/{person_id}/shift", headers=header)
+    comments = [shift["comment"] for shift in response.json()["items"]]
+    assert comments == [None, "two\nlines, quoted"]
+
+    response = client.get("/person?search_string=Imported", headers=header)
+    for person in response.json()["items"]:
+        client.delete(f"/person/{person['id']}", headers=header)
+
+
 # --------------- Put ---------------
 
 
@@ -215,12 +348,166 @@ def test_valid_get_shift_from_person():
     assert response.status_code == 200
 
 
+def test_valid_get_shift_from_person_paginated():
+    """Test that date filters and the page window are applied to the shifts of a person"""
+    response = client.get(
+        "/person/1/shift?start_date=2024-02-17&end_date=2024-02-17&size=1",
+        headers=header,
+    )
+    assert response.status_code == 200
+    page = response.json()
+    assert page["total"] >= 1
+    assert len(page["items"]) == 1
+    assert page["items"][0]["start_time"].startswith("2024-02-17")
+
+    response = client.get("/person/1/shift?start_date=2025-01-01", headers=header)
+    assert response.status_code == 200
+    assert response.json()["total"] == 0
+    assert response.json()["items"] == []
+
+
 def test_valid_get_shifts():
     """Test for retrieving list of existing shifts"""
     response = client.get("/shift", headers=header)
     assert response.status_code == 200
 
 
+def test_valid_get_shifts_paginated():
+    """Test that the page window and total of the shift listing are computed correctly"""
+    response = client.get("/shift?sort_by=start_time&order_type=desc", headers=header)
+    assert response.status_code == 200
+    all_shifts = response.json()
+    start_times = [shift["start_time"] for shift in all_shifts["items"]]
+    assert start_times == sorted(start_times, reverse=True)
+
+    response = client.get(
+        "/shift?sort_by=start_time&order_type=desc&size=1&page=1", headers=header
+    )
+    page = response.json()
+    assert page["total"] == all_shifts["total"]
+    assert page["items"] == all_shifts["items"][:1]
+    assert page["items"][0]["first_name"] == "Peter"
+
+    response = client.get("/shift?size=1&page=1000", headers=header)
+    assert response.status_code == 200
+    assert response.json()["items"] == []
+    assert response.json()["total"] == all_shifts["total"]
+
+
+def test_valid_get_shifts_by_cursor():
+    """Test that following next_cursor visits the same shifts as offset pagination"""
+    response = client.get("/shift?sort_by=start_time&order_type=desc", headers=header)
+    expected_ids = [shift["id"] for shift in response.json()["items"]]
+
+    ids = []
+    cursor = ""
+    while cursor is not None:
+        response = client.get(
+            "/shift",
+            params={
+                "sort_by": "start_time",
+                "order_type": "desc",
+                "size": 1,
+                "cursor": cursor,
+            },
+            headers=header,
+        )
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= 1
+        ids.extend(shift["id"] for shift in page["items"])
+        cursor = page["next_cursor"]
+
+    assert ids == expected_ids
+
+
+def test_invalid_get_persons_by_cursor():
+    response = client.get("/person?cursor=notacursor", headers=header)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+    response = client.get("/person?cursor=&sort_by=last_name", headers=header)
+    assert response.status_code == 400
+
+    # Well-formed cursors holding values of the wrong type for the sort keys
+    for values in (["a", "b"], [{"a": 1}, 1], ["Peter", True]):
+        cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+        response = client.get(
+            "/person",
+            params={"cursor": cursor, "sort_by": "first_name", "order_type": "asc"},
+            headers=header,
+        )
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+
+def walk_cursor(url, params):
+    """Follows next_cursor one item at a time and returns the visited items"""
+    items = []
+    cursor = ""
+    while cursor is not None:
+        response = client.get(
+            url, params={**params, "size": 1, "cursor": cursor}, headers=header
+        )
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= 1
+        items.extend(page["items"])
+        cursor = page["next_cursor"]
+    return items
+
+
+def test_valid_get_persons_by_cursor_with_duplicate_sort_keys():
+    """Test that the id tiebreaker walks across persons with the same first name"""
+    for last_name in ("Tiebreak", "Tiebreaker", "Tiebreaking"):
+        data = {"first_name": "Tie", "last_name": last_name}
+        response = client.post("/person", json=data, headers=header)
+        assert response.status_code == 200
+
+    for order_type in ("asc", "desc"):
+        params = {"sort_by": "first_name", "order_type": order_type}
+        response = client.get("/person", params=params, headers=header)
+        expected_ids = [person["id"] for person in response.json()["items"]]
+
+        persons = walk_cursor("/person", params)
+        assert [person["id"] for person in persons] == expected_ids
+        assert [p["first_name"] for p in persons].count("Tie") == 3
+
+
+def test_valid_get_overtimes_by_cursor():
+    response = client.get("/overtime", headers=header)
+    expected = response.json()["items"]
+    assert len(expected) >= 2
+
+    assert walk_cursor("/overtime", {}) == expected
+
+
+def test_valid_export_shifts():
+    """Test that exported shifts match the shift listing in both formats"""
+    response = client.get("/shift?sort_by=start_time&order_type=asc", headers=header)
+    expected = response.json()["items"]
+
+    response = client.get("/shift/export?format=ndjson", headers=header)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == expected
+
+    response = client.get(
+        "/shift/export?format=csv&start_date=2024-02-17&end_date=2024-02-17",
+        headers=header,
+    )
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0].split(",")[:2] == ["id", "start_time"]
+    assert len(lines) - 1 == sum(
+        shift["start_time"].startswith("2024-02-17") for shift in expected
+    )
+
+    response = client.get("/shift/export?format=xml", headers=header)
+    assert response.status_code == 400
+
+
 def test_valid_get_shift_by_name():
     response = client.get("shift?search_string=Boba")
     assert response.status_code == 403
@@ -273,7 +560,511 @@ def test_valid_get_shift_by_name():
     json_response = response.json()
     items_list = json_response.get("items", [])
     for shift in items_list:
-        assert shift['last_name'] == 'Postman'
+        assert shift["last_name"] == "Postman"
+
+
+def test_valid_get_hours_report():
+    """Test worked and overtime hours grouped by day, week and month"""
+    client.post(
+        "/person", json={"first_name": "Report", "last_name": "Hours"}, headers=header
+    )
+    response = client.get("/person?search_string=Report%20Hours", headers=header)
+    person_id = response.json()["items"][0]["id"]
+
+    shifts = [
+        # Monday and tuesday of one week, sunday of the week before
+        ("2024-04-01T08:00:00", "2024-04-01T16:30:00"),
+        ("2024-04-02T22:00:00", "2024-04-03T02:00:00"),
+        ("2024-03-31T10:00:00", "2024-03-31T12:00:00"),
+    ]
+    response = client.post(
+        "/shift/bulk",
+        json=[
+            {"start_time": start, "end_time": end, "person_id": person_id}
+            for start, end in shifts
+        ],
+        headers=header,
+    )
+    assert response.json()["inserted"] == 3
+
+    response = client.get(
+        f"/person/{person_id}/shift?sort_by=start_time&order_type=asc", headers=header
+    )
+    shift_id = response.json()["items"][1]["id"]
+    client.post(
+        "/overtime",
+        json={"type": "Report", "hours": 2, "shift_id": shift_id},
+        headers=header,
+    )
+
+    def buckets(group_by):
+        response = client.get(
+            f"/report/hours?group_by={group_by}&person_id={person_id}", headers=header
+        )
+        assert response.status_code == 200
+        [person] = response.json()
+        assert person["first_name"] == "Report"
+        return [
+            (b["period"], b["shift_count"], b["hours_worked"], b["overtime_hours"])
+            for b in person["buckets"]
+        ]
+
+    assert buckets("day") == [
+        ("2024-03-31", 1, 2.0, 0),
+        ("2024-04-01", 1, 8.5, 2),
+        ("2024-04-02", 1, 4.0, 0),
+    ]
+    assert buckets("week") == [("2024-03-25", 1, 2.0, 0), ("2024-04-01", 2, 12.5, 2)]
+    assert buckets("month") == [("2024-03-01", 1, 2.0, 0), ("2024-04-01", 2, 12.5, 2)]
+
+    response = client.get(
+        f"/report/hours?person_id={person_id}&start_date=2024-04-02", headers=header
+    )
+    assert response.json()[0]["buckets"][0]["period"] == "2024-04-02"
+
+    response = client.get("/report/hours?group_by=year", headers=header)
+    assert response.status_code == 400
+
+    client.delete(f"/person/{person_id}", headers=header)
+
+
+def test_hours_summary_follows_shift_changes():
+    """Test that the daily summary is updated by shift writes and matches a rebuild"""
+    client.post(
+        "/person", json={"first_name": "Summary", "last_name": "Hours"}, headers=header
+    )
+    response = client.get("/person?search_string=Summary%20Hours", headers=header)
+    person_id = response.json()["items"][0]["id"]
+
+    def summary_rows():
+        summary = models.PersonDailyHours
+        with schema_engine.connect() as conn:
+            rows = conn.execute(
+                select(
+                    summary.day,
+                    summary.shift_count,
+                    summary.seconds_worked,
+                    summary.overtime_hours,
+                )
+                .filter(summary.person_id == person_id)
+                .order_by(summary.day)
+            )
+            return [(str(day), *values) for day, *values in rows]
+
+    for start, end in (
+        ("2024-05-01T08:00:00", "2024-05-01T12:00:00"),
+        ("2024-05-01T13:00:00", "2024-05-01T14:00:00"),
+    ):
+        data = {"start_time": start, "end_time": end, "person_id": person_id}
+        client.post("/shift", json=data, headers=header)
+    assert summary_rows() == [("2024-05-01", 2, 18000, 0)]
+
+    response = client.get(
+        f"/person/{person_id}/shift?sort_by=start_time&order_type=asc", headers=header
+    )
+    first_id, second_id = [shift["id"] for shift in response.json()["items"]]
+    client.post(
+        "/overtime",
+        json={"type": "Summary", "hours": 3, "shift_id": first_id},
+        headers=header,
+    )
+    assert summary_rows() == [("2024-05-01", 2, 18000, 3)]
+
+    # Moving a shift to another day moves its hours and overtime along
+    data = {
+        "start_time": "2024-05-02T08:00:00",
+        "end_time": "2024-05-02T10:00:00",
+        "person_id": person_id,
+    }
+    response = client.put(f"/shift/{first_id}", json=data, headers=header)
+    assert response.status_code == 200
+    assert summary_rows() == [("2024-05-01", 1, 3600, 0), ("2024-05-02", 1, 7200, 3)]
+
+    client.delete(f"/shift/{second_id}", headers=header)
+    assert summary_rows() == [("2024-05-02", 1, 7200, 3)]
+
+    incremental = summary_rows()
+    with schema_engine.begin() as conn:
+        rebuild_summary(conn)
+    assert summary_rows() == incremental
+
+    client.delete(f"/person/{person_id}", headers=header)
+    assert summary_rows() == []
+
+
+def test_cached_lookups_are_invalidated_by_writes():
+    """Test that repeated lookups hit the cache and that writes invalidate it"""
+    client.post(
+        "/person", json={"first_name": "Cached", "last_name": "Kiosk"}, headers=header
+    )
+    response = client.get("/person?search_string=Cached%20Kiosk", headers=header)
+    person_id = response.json()["items"][0]["id"]
+    data = {
+        "start_time": "2024-06-01T08:00:00",
+        "end_time": "2024-06-01T12:00:00",
+        "person_id": person_id,
+    }
+    client.post("/shift", json=data, headers=header)
+    response = client.get(f"/person/{person_id}/shift", headers=header)
+    shift_id = response.json()["items"][0]["id"]
+
+    before = client.get("/cache/stats", headers=header).json()
+    for _ in range(3):
+        assert client.get(f"/person/{person_id}", headers=header).status_code == 200
+        assert client.get(f"/shift/{shift_id}", headers=header).status_code == 200
+        assert client.get(f"/overtime/{shift_id}", headers=header).json() == []
+    after = client.get("/cache/stats", headers=header).json()
+    for entity in ("person", "shift", "overtime"):
+        hits = before.get(entity, {}).get("hits", 0)
+        misses = before.get(entity, {}).get("misses", 0)
+        assert after[entity] == {"hits": hits + 2, "misses": misses + 1}
+
+    data = {"first_name": "Renamed", "last_name": "Kiosk"}
+    client.put(f"/person/{person_id}", json=data, headers=header)
+    response = client.get(f"/person/{person_id}", headers=header)
+    assert response.json()["first_name"] == "Renamed"
+    response = client.get(f"/shift/{shift_id}", headers=header)
+    assert response.json()["first_name"] == "Renamed"
+
+    client.post(
+        "/overtime",
+        json={"type": "Cached", "hours": 1, "shift_id": shift_id},
+        headers=header,
+    )
+    response = client.get(f"/overtime/{shift_id}", headers=header)
+    assert [overtime["hours"] for overtime in response.json()] == [1]
+
+    client.delete(f"/person/{person_id}", headers=header)
+    assert client.get(f"/person/{person_id}", headers=header).status_code == 404
+    assert client.get(f"/shift/{shift_id}", headers=header).status_code == 404
+    assert client.get(f"/overtime/{shift_id}", headers=header).status_code == 404
+
+
+def test_conditional_get_with_etags():
+    """Test that unchanged responses are answered with 304 until a write"""
+    client.post(
+        "/person", json={"first_name": "Etag", "last_name": "Poller"}, headers=header
+    )
+    response = client.get("/person?search_string=Etag%20Poller", headers=header)
+    person_id = response.json()["items"][0]["id"]
+
+    urls = [f"/person/{person_id}", "/person?size=5", f"/person/{person_id}/shift"]
+    etags = {}
+    for url in urls:
+        response = client.get(url, headers=header)
+        assert response.status_code == 200
+        etags[url] = response.headers["etag"]
+        response = client.get(url, headers={**header, "If-None-Match": etags[url]})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etags[url]
+    # Each query string has its own ETag
+    assert (
+        client.get("/person?size=6", headers=header).headers["etag"]
+        != etags["/person?size=5"]
+    )
+
+    data = {
+        "start_time": "2024-07-01T08:00:00",
+        "end_time": "2024-07-01T12:00:00",
+        "person_id": person_id,
+    }
+    client.post("/shift", json=data, headers=header)
+    for url, status_code in zip(urls, [304, 304, 200]):
+        response = client.get(url, headers={**header, "If-None-Match": etags[url]})
+        assert response.status_code == status_code
+
+    data = {"first_name": "Etag", "last_name": "Renamed"}
+    client.put(f"/person/{person_id}", json=data, headers=header)
+    response = client.get(urls[0], headers={**header, "If-None-Match": etags[urls[0]]})
+    assert response.status_code == 200
+    assert response.json()["last_name"] == "Renamed"
+
+    client.delete(f"/person/{person_id}", headers=header)
+
+
+def test_large_pages_are_compressed():
+    """Test that large pages are gzipped and keep the page fields and the ETag"""
+    response = client.get(
+        "/shift?size=50", headers={**header, "Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"]
+    page = response.json()
+    assert {"items", "total", "page", "size", "pages", "links"} <= page.keys()
+    assert set(page["items"][0]) == set(ShiftOut.model_fields)
+
+
+def test_sparse_fieldsets():
+    """Test that fields= narrows the selected columns and the returned items"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.get(
+            "/shift?size=3&fields=start_time,first_name", headers=header
+        )
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert items and all(set(item) == {"start_time", "first_name"} for item in items)
+    [page_statement] = [s for s in statements if "LIMIT" in s]
+    assert "field_A" not in page_statement and "end_time" not in page_statement
+
+    # The cursor is built from the sort keys even when they are not returned
+    url = "/shift?size=2&sort_by=start_time&order_type=asc&fields=comment&cursor="
+    page = client.get(url, headers=header).json()
+    assert all(set(item) == {"comment"} for item in page["items"])
+    response = client.get(url + page["next_cursor"], headers=header)
+    assert response.status_code == 200
+
+    response = client.get("/shift?size=1&fields=id", headers=header)
+    shift_id = response.json()["items"][0]["id"]
+    response = client.get(f"/shift/{shift_id}?fields=id,last_name", headers=header)
+    assert set(response.json()) == {"id", "last_name"}
+
+    response = client.get("/person?fields=first_name,password", headers=header)
+    assert response.status_code == 400
+
+
+def test_include_overtime():
+    """Test that include=overtime embeds the overtimes with one batched query"""
+    client.post(
+        "/person", json={"first_name": "Include", "last_name": "Ot"}, headers=header
+    )
+    response = client.get("/person?search_string=Include%20Ot", headers=header)
+    person_id = response.json()["items"][0]["id"]
+    for day in (1, 2, 3):
+        data = {
+            "start_time": f"2024-08-0{day}T08:00:00",
+            "end_time": f"2024-08-0{day}T12:00:00",
+            "person_id": person_id,
+        }
+        client.post("/shift", json=data, headers=header)
+    response = client.get(
+        f"/person/{person_id}/shift?sort_by=start_time&order_type=asc", headers=header
+    )
+    shift_ids = [shift["id"] for shift in response.json()["items"]]
+    client.post(
+        "/overtime",
+        json={"type": "Include", "hours": 2, "shift_id": shift_ids[1]},
+        headers=header,
+    )
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = client.get(
+            f"/person/{person_id}/shift?sort_by=start_time&order_type=asc"
+            "&include=overtime&fields=start_time",
+            headers=header,
+        )
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+    items = response.json()["items"]
+    assert [len(item["overtimes"]) for item in items] == [0, 1, 0]
+    assert items[1]["overtimes"][0]["hours"] == 2
+    assert set(items[0]) == {"start_time", "overtimes"}
+    assert len([s for s in statements if "FROM overtimes" in s]) == 1
+
+    response = client.get("/shift?include=overtime&cursor=&size=2", headers=header)
+    assert all("overtimes" in item for item in response.json()["items"])
+
+    response = client.get(f"/shift/{shift_ids[1]}?include=overtime", headers=header)
+    assert [overtime["type"] for overtime in response.json()["overtimes"]] == [
+        "Include"
+    ]
+    response = client.get("/shift?include=person", headers=header)
+    assert response.status_code == 400
+
+    client.delete(f"/person/{person_id}", headers=header)
+
+
+def test_lookup_by_ids():
+    """Test that many ids are resolved in request order with the missing ids"""
+    response = client.post(
+        "/person/bulk",
+        json=[{"first_name": "Lookup", "last_name": f"L{i}"} for i in range(3)],
+        headers=header,
+    )
+    response = client.get(
+        "/person?search_string=Lookup&sort_by=last_name&order_type=asc", headers=header
+    )
+    person_ids = [person["id"] for person in response.json()["items"]]
+    assert len(person_ids) == 3
+
+    ids = [person_ids[2], 123456, person_ids[0], person_ids[2]]
+    response = client.get(
+        f"/person?ids={','.join(map(str, ids))}&fields=id,last_name", headers=header
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "items": [
+            {"id": person_ids[2], "last_name": "L2"},
+            {"id": person_ids[0], "last_name": "L0"},
+        ],
+        "missing": [123456],
+    }
+
+    response = client.post("/person/lookup", json=ids, headers=header)
+    assert [person["last_name"] for person in response.json()["items"]] == [
+        "L2",
+        "L0",
+    ]
+
+    data = {
+        "start_time": "2024-09-01T08:00:00",
+        "end_time": "2024-09-01T12:00:00",
+        "person_id": person_ids[1],
+    }
+    client.post("/shift", json=data, headers=header)
+    response = client.get(f"/person/{person_ids[1]}/shift", headers=header)
+    shift_id = response.json()["items"][0]["id"]
+    response = client.post(
+        "/shift/lookup?include=overtime", json=[123456, shift_id], headers=header
+    )
+    assert [shift["last_name"] for shift in response.json()["items"]] == ["L1"]
+    assert response.json()["items"][0]["overtimes"] == []
+    assert response.json()["missing"] == [123456]
+
+    response = client.get(f"/overtime?shift_ids={shift_id}", headers=header)
+    assert response.json() == {"items": [], "missing": [shift_id]}
+
+    response = client.get("/shift?ids=1,two", headers=header)
+    assert response.status_code == 400
+    response = client.post("/person/lookup", json=list(range(1001)), headers=header)
+    assert response.status_code == 400
+
+    for person_id in person_ids:
+        client.delete(f"/person/{person_id}", headers=header)
+
+
+def test_pool_stats():
+    response = client.get("/pool/stats")
+    assert response.status_code == 403
+
+    response = client.get("/pool/stats", headers=header)
+    assert response.status_code == 200
+    assert {"size", "checked_out", "overflow", "wait_seconds_max"} <= set(
+        response.json()
+    )
+
+
+def scrape_metrics() -> dict:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.text)
+        for sample in family.samples
+    }
+
+
+def test_metrics():
+    """Test request counts, latency and SQL statements per route on /metrics"""
+    client.post(
+        "/person", json={"first_name": "Metric", "last_name": "Scraper"}, headers=header
+    )
+    response = client.get("/person?search_string=Metric%20Scraper", headers=header)
+    person_id = response.json()["items"][0]["id"]
+    route = (("method", "GET"), ("route", "/person/{person_id}"))
+    ok = (("method", "GET"), ("route", "/person/{person_id}"), ("status", "200"))
+    missing = (("method", "GET"), ("route", "/person/{person_id}"), ("status", "404"))
+
+    before = scrape_metrics()
+    for _ in range(2):
+        client.get(f"/person/{person_id}", headers=header)
+    client.get("/person/123456", headers=header)
+    after = scrape_metrics()
+
+    def increase(name, labels):
+        return after.get((name, labels), 0) - before.get((name, labels), 0)
+
+    assert increase("http_requests_total", ok) == 2
+    assert increase("http_requests_total", missing) == 1
+    assert increase("http_request_duration_seconds_count", route) == 3
+    assert increase("http_request_db_queries_count", route) == 3
+    assert increase("http_request_db_queries_sum", route) > 0
+    # Paths without a route share one label
+    client.get("/no/such/path")
+    assert (
+        "http_requests_total",
+        (("method", "GET"), ("route", "unmatched"), ("status", "404")),
+    ) in scrape_metrics()
+
+    client.delete(f"/person/{person_id}", headers=header)
+
+
+def test_query_counts():
+    """Test that the list endpoints take a fixed number of statements however
+    many rows they return, and the X-DB-Queries and X-DB-Time headers"""
+    client.post(
+        "/person", json={"first_name": "Query", "last_name": "Budget"}, headers=header
+    )
+    response = client.get("/person?search_string=Query%20Budget", headers=header)
+    person_id = response.json()["items"][0]["id"]
+    for day in range(1, 6):
+        data = {
+            "start_time": f"2024-09-0{day}T08:00:00",
+            "end_time": f"2024-09-0{day}T20:00:00",
+            "person_id": person_id,
+        }
+        client.post("/shift", json=data, headers=header)
+    response = client.get(f"/person/{person_id}/shift", headers=header)
+    for shift in response.json()["items"]:
+        client.post(
+            "/overtime",
+            json={"type": "Budget", "hours": 2, "shift_id": shift["id"]},
+            headers=header,
+        )
+
+    budgets = {
+        "/person?size=50": 3,
+        "/shift?size=50": 3,
+        "/shift?size=50&include=overtime": 4,
+        f"/person/{person_id}/shift?include=overtime": 5,
+        "/shift?cursor=&size=50&include=overtime": 3,
+        "/overtime?size=50": 3,
+        "/report/hours?period=week": 2,
+    }
+    for url, maximum in budgets.items():
+        with assert_max_queries(maximum):
+            response = client.get(url, headers=header)
+        assert response.status_code == 200, url
+        assert int(response.headers["X-DB-Queries"]) <= maximum
+        assert float(response.headers["X-DB-Time"]) >= 0
+
+    client.delete(f"/person/{person_id}", headers=header)
+
+
+def test_repeated_statements_are_logged(caplog):
+    """Test that a statement repeated within one request is logged as N+1"""
+    stats = QueryStats()
+    for _ in range(3):
+        stats.record("SELECT * FROM overtimes WHERE shift_id = ?", 0.001)
+    stats.record("SELECT * FROM shifts", 0.001)
+    middleware = QueryStatsMiddleware(app, max_queries=10, repeated_threshold=3)
+    scope = {"method": "GET", "path": "/shift"}
+
+    with caplog.at_level(logging.WARNING, logger="api.instrumentation"):
+        middleware.log(scope, stats)
+    assert len(caplog.records) == 1
+    assert "3 times" in caplog.text
+    assert "FROM overtimes" in caplog.text
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="api.instrumentation"):
+        QueryStatsMiddleware(app, max_queries=3).log(scope, stats)
+    assert "GET /shift executed 4 statements" in caplog.text
 
 
 def test_invalid_get_person_by_id():
@@ -300,6 +1091,34 @@ def test_valid_get_person_by_name():
     assert len(items_list) >= 1, "Items list is empty"
 
 
+def test_valid_get_person_by_substring():
+    """Test substring search through the trigram index, short terms and ranking"""
+    for data in (
+        {"first_name": "Marianne", "last_name": "Searchable"},
+        {"first_name": "Mari", "last_name": "Searchable"},
+    ):
+        response = client.post("/person", json=data, headers=header)
+        assert response.status_code == 200
+
+    response = client.get("/person?search_string=ARIAN", headers=header)
+    names = [person["first_name"] for person in response.json()["items"]]
+    assert names == ["Marianne"]
+
+    response = client.get("/person?search_string=mari", headers=header)
+    names = [person["first_name"] for person in response.json()["items"]]
+    assert names == ["Mari", "Marianne"]
+
+    response = client.get("/person?search_string=ri%20chab", headers=header)
+    names = [person["first_name"] for person in response.json()["items"]]
+    assert sorted(names) == ["Mari", "Marianne"]
+
+    data = {"first_name": "Mari", "last_name": "Renamed"}
+    person_id = response.json()["items"][0]["id"]
+    response = client.put(f"/person/{person_id}", json=data, headers=header)
+    response = client.get("/person?search_string=renam", headers=header)
+    assert [person["id"] for person in response.json()["items"]] == [person_id]
+
+
 def test_invalid_get_person_by_name():
     response = client.get("/person?search_string=NotExisting")
     assert response.status_code == 403
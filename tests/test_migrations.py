@@ -0,0 +1,79 @@
+"""
+Test file for applying the versioned schema migrations.
+"""
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import StaticPool
+from api.database import Base
+from api.migrations import MIGRATIONS, applied_versions, run_migrations
+
+
+def new_engine():
+    return create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+
+
+def index_names(engine, table_name):
+    return {index["name"] for index in inspect(engine).get_indexes(table_name)}
+
+
+def test_migrations_on_existing_database():
+    """Test that the indexes are added to a database created before they existed"""
+    engine = new_engine()
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE persons (id INTEGER PRIMARY KEY, first_name VARCHAR(35),"
+                " last_name VARCHAR(35), display_tag VARCHAR(8) UNIQUE)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE shifts (id INTEGER PRIMARY KEY, start_time DATETIME,"
+                " end_time DATETIME, person_id INTEGER NOT NULL)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE overtimes (shift_id INTEGER PRIMARY KEY, type VARCHAR(50),"
+                " hours INTEGER)"
+            )
+        )
+        conn.execute(text("INSERT INTO persons (first_name) VALUES ('Anders')"))
+        conn.execute(
+            text(
+                "INSERT INTO shifts (start_time, end_time, person_id) VALUES"
+                " ('2024-04-01 08:00:00', '2024-04-01 16:30:00', 1)"
+            )
+        )
+        conn.execute(text("INSERT INTO overtimes (shift_id, hours) VALUES (1, 2)"))
+
+    applied = run_migrations(engine)
+
+    assert applied == [migration.version for migration in MIGRATIONS]
+    assert {"ix_shifts_person_id_start_time", "ix_shifts_start_time"} <= index_names(
+        engine, "shifts"
+    )
+    assert {"ix_persons_last_name", "ix_persons_first_name"} <= index_names(
+        engine, "persons"
+    )
+    with engine.connect() as conn:
+        assert conn.scalar(text("SELECT first_name FROM persons")) == "Anders"
+        trigrams = conn.scalars(text("SELECT trigram FROM person_trigrams")).all()
+        assert sorted(trigrams) == ["and", "der", "ers", "nde"]
+        summary = conn.execute(text("SELECT * FROM person_daily_hours")).all()
+        assert summary == [(1, "2024-04-01", 1, 30600, 2)]
+
+
+def test_migrations_are_applied_once():
+    """Test that a fresh database from create_all is migrated without errors
+    and that running the migrations again does nothing"""
+    engine = new_engine()
+    Base.metadata.create_all(bind=engine)
+
+    run_migrations(engine)
+    assert applied_versions(engine) == {m.version for m in MIGRATIONS}
+    assert run_migrations(engine) == []
@@ -0,0 +1,112 @@
+"""
+Test file for resetting the database, its snapshots and the rolled back client.
+"""
+
+import os
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.pool import StaticPool
+from api import models
+from api.database import Base
+from api.reset import Snapshots, reset_database
+from api.seed import SeedOptions, seed
+from tests.database import schema_engine
+
+OPTIONS = SeedOptions(persons=20, shifts=200, batch_size=64)
+header = {"access_token": os.environ.get("API_KEY")}
+
+
+def seeded_engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        seed(conn, OPTIONS)
+    return engine
+
+
+def count(engine, table) -> int:
+    with engine.connect() as conn:
+        return conn.scalar(select(func.count()).select_from(table))
+
+
+def test_reset_removes_rows_and_bumps_versions():
+    engine = seeded_engine()
+    with engine.begin() as conn:
+        reset_database(conn)
+    for table in (
+        models.Person,
+        models.PersonTrigram,
+        models.Shift,
+        models.Overtime,
+        models.PersonDailyHours,
+    ):
+        assert count(engine, table) == 0
+
+    with engine.connect() as conn:
+        versions = dict(
+            conn.execute(
+                select(models.TableVersion.name, models.TableVersion.version)
+            ).all()
+        )
+    assert versions["persons"] == versions["shifts"] == versions["overtimes"] == 2
+
+    # The ids start over
+    with engine.begin() as conn:
+        seed(conn, OPTIONS._replace(persons=1, shifts=1))
+    with engine.connect() as conn:
+        assert conn.scalar(select(models.Person.id)) == 1
+        assert conn.scalar(select(models.Shift.id)) == 1
+
+
+@pytest.mark.parametrize("in_directory", [False, True])
+def test_snapshot_restores_rows(tmp_path, in_directory):
+    engine = seeded_engine()
+    snapshots = Snapshots(engine, str(tmp_path) if in_directory else None)
+    assert "seeded" not in snapshots
+    snapshots.save("seeded")
+    assert "seeded" in snapshots
+
+    with engine.begin() as conn:
+        reset_database(conn)
+    assert count(engine, models.Shift) == 0
+
+    snapshots.restore("seeded")
+    assert count(engine, models.Person) == OPTIONS.persons
+    assert count(engine, models.Shift) == OPTIONS.shifts
+    with pytest.raises(KeyError):
+        snapshots.restore("missing")
+
+
+def test_rolled_back_client(rolled_back_client):
+    data = {"first_name": "Rolf", "last_name": "Back"}
+    response = rolled_back_client.post("/person", json=data, headers=header)
+    assert response.status_code == 200
+    response = rolled_back_client.get(
+        "/person?search_string=Rolf%20Back", headers=header
+    )
+    [person] = response.json()["items"]
+
+    response = rolled_back_client.post(
+        "/shift",
+        json={
+            "start_time": "2024-01-01T08:00:00",
+            "end_time": "2024-01-01T16:00:00",
+            "comment": "rolled back",
+            "person_id": person["id"],
+        },
+        headers=header,
+    )
+    assert response.status_code == 200
+    response = rolled_back_client.get(f"/person/{person['id']}", headers=header)
+    assert response.status_code == 200
+
+
+def test_rolled_back_client_leaves_no_rows():
+    """Runs after test_rolled_back_client"""
+    with schema_engine.connect() as conn:
+        assert not conn.scalar(
+            select(func.count()).where(models.Person.first_name == "Rolf")
+        )
+        assert not conn.scalar(
+            select(func.count()).where(models.Shift.comment == "rolled back")
+        )
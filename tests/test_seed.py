@@ -0,0 +1,85 @@
+"""
+Test file for the generated test data.
+"""
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.pool import StaticPool
+from api import models
+from api.database import Base
+from api.seed import SeedOptions, seed
+
+OPTIONS = SeedOptions(persons=50, shifts=500, batch_size=64)
+
+
+def seeded_engine(*options: SeedOptions):
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for option in options:
+            seed(conn, option)
+    return engine
+
+
+def rows(engine, table) -> list:
+    with engine.connect() as conn:
+        return conn.execute(select(table).order_by(*table.primary_key)).all()
+
+
+def test_same_seed_gives_same_rows():
+    first, second = seeded_engine(OPTIONS), seeded_engine(OPTIONS)
+    for table in (models.Person, models.Shift, models.Overtime):
+        columns = [
+            c for c in table.__table__.c if c.name not in ("created_at", "updated_at")
+        ]
+        query = select(*columns).order_by(*table.__table__.primary_key)
+        with first.connect() as a, second.connect() as b:
+            assert a.execute(query).all() == b.execute(query).all()
+
+    other = seeded_engine(OPTIONS._replace(seed=2))
+    assert rows(other, models.Shift.__table__) != rows(first, models.Shift.__table__)
+
+
+def test_seeded_rows_are_consistent():
+    """Test that a second run adds to the first one and that the trigrams,
+    display tags, summary and versions match the rows"""
+    engine = seeded_engine(OPTIONS, OPTIONS._replace(overnight_share=1))
+    persons = rows(engine, models.Person.__table__)
+    shifts = rows(engine, models.Shift.__table__)
+    assert [person.id for person in persons] == list(range(1, 101))
+    assert [shift.id for shift in shifts] == list(range(1, 1001))
+    assert len({person.display_tag for person in persons}) == 100
+
+    for shift in shifts:
+        assert shift.start_time < shift.end_time
+        assert OPTIONS.start_date <= shift.start_time < OPTIONS.end_date
+    # Every shift of the second run crosses midnight
+    assert all(
+        shift.end_time.date() > shift.start_time.date() for shift in shifts[500:]
+    )
+
+    with engine.connect() as conn:
+        assert (
+            conn.scalar(
+                select(func.count(func.distinct(models.PersonTrigram.person_id)))
+            )
+            == 100
+        )
+        summary = models.PersonDailyHours
+        assert conn.scalar(select(func.sum(summary.shift_count))) == 1000
+        assert conn.scalar(select(func.sum(summary.overtime_hours))) == conn.scalar(
+            select(func.sum(models.Overtime.hours))
+        )
+        versions = dict(
+            conn.execute(
+                select(models.TableVersion.name, models.TableVersion.version)
+            ).all()
+        )
+        assert versions == {"persons": 2, "shifts": 2, "overtimes": 2}
+
+
+def test_shifts_need_persons():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with pytest.raises(ValueError), engine.begin() as conn:
+        seed(conn, SeedOptions(persons=0, shifts=1))